@@ -11,7 +11,10 @@
 #-----------------------------------------------------------------------------
 
 from __future__ import division, print_function
-import struct,  math, warnings
+import heapq, itertools, operator, struct,  math, warnings
+from concurrent.futures import ProcessPoolExecutor
+
+from als_to_midi import profiling
 
 # TICKSPERBEAT is the number of "ticks" (time measurement in the MIDI file) that
 # corresponds to one beat. This number is somewhat arbitrary, but should be chosen
@@ -32,20 +35,106 @@ FLATS  = -1
 
 __all__ = ['MIDIFile', 'MAJOR', 'MINOR', 'SHARPS', 'FLATS']
 
+# Precompiled layouts for the fixed-size parts of the encoded events.
+
+_STATUS_PAIR    = struct.Struct('>BB')
+_CHANNEL_EVENT  = struct.Struct('>BBB')
+_META_HEADER    = struct.Struct('>BBB')
+_KEY_SIGNATURE  = struct.Struct('>bB')
+_TIME_SIGNATURE = struct.Struct('>BBBB')
+
+# Integer codes of the kinds of events. They index the tables of the
+# functions that expand (``_EXPANDERS``) and encode (``_ENCODERS``) each kind.
+# A note is of kind NOTE_ON before it is expanded into its NoteOn and NoteOff.
+
+(NOTE_ON, NOTE_OFF, TEMPO, COPYRIGHT, TEXT, KEY_SIGNATURE, PROGRAM_CHANGE,
+ TRACK_NAME, CONTROLLER, PITCH_WHEEL, CHANNEL_PRESSURE, SYSEX, UNIVERSAL_SYSEX,
+ TIME_SIGNATURE) = range(14)
+
+_MIDI_EVENT_KINDS = {'NoteOn': NOTE_ON, 'NoteOff': NOTE_OFF, 'Tempo': TEMPO,
+                     'Copyright': COPYRIGHT, 'Text': TEXT,
+                     'KeySignature': KEY_SIGNATURE,
+                     'ProgramChange': PROGRAM_CHANGE, 'TrackName': TRACK_NAME,
+                     'ControllerEvent': CONTROLLER,
+                     'PitchWheelEvent': PITCH_WHEEL,
+                     'ChannelPressureEvent': CHANNEL_PRESSURE, 'SysEx': SYSEX,
+                     'UniversalSysEx': UNIVERSAL_SYSEX,
+                     'TimeSignature': TIME_SIGNATURE}
+
+# The key by which the events of a track are sorted, see ``sort_events``.
+
+_SORT_KEY = operator.attrgetter('time', 'ord', 'insertion_order')
+
+# The number of events encoded between two writes of a streamed track.
+_STREAM_BATCH = 4096
+
 class MIDIEvent(object):
     '''
     The class to contain the MIDI Event (placed on MIDIEventList).
+    
+    The data of each kind of event is held by one of the subclasses below,
+    which all have a fixed set of attributes (``__slots__``) so that no
+    per-event ``__dict__`` is allocated.
+    
+    ``kind`` is the integer code of ``type``; it is looked up when not given.
     '''
-    def __init__(self, type="unknown", time = 0, ordinal=0, insertion_order=0):
+    __slots__ = ('type', 'kind', 'time', 'ord', 'insertion_order')
+    
+    def __init__(self, type="unknown", time = 0, ordinal=0, insertion_order=0, kind=None):
         self.type=type
+        self.kind = _MIDI_EVENT_KINDS.get(type) if kind is None else kind
         self.time=time
         self.ord = ordinal
         self.insertion_order=insertion_order
 
+class MIDINoteEvent(MIDIEvent):
+    __slots__ = ('pitch', 'volume', 'channel')
+
+class MIDITempoEvent(MIDIEvent):
+    __slots__ = ('tempo',)
+
+class MIDICopyrightEvent(MIDIEvent):
+    __slots__ = ('notice',)
+
+class MIDITextEvent(MIDIEvent):
+    __slots__ = ('text',)
+
+class MIDIKeySignatureEvent(MIDIEvent):
+    __slots__ = ('accidentals', 'accidental_type', 'mode')
+
+class MIDIProgramChangeEvent(MIDIEvent):
+    __slots__ = ('programNumber', 'channel')
+
+class MIDITrackNameEvent(MIDIEvent):
+    __slots__ = ('trackName',)
+
+class MIDIControllerEvent(MIDIEvent):
+    __slots__ = ('controller_number', 'channel', 'parameter')
+
+class MIDIPitchWheelEvent(MIDIEvent):
+    __slots__ = ('pitch_wheel_value', 'channel')
+
+class MIDIChannelPressureEvent(MIDIEvent):
+    __slots__ = ('vibrato_value', 'channel')
+
+class MIDISysExEvent(MIDIEvent):
+    __slots__ = ('manID', 'payload')
+
+class MIDIUniversalSysExEvent(MIDIEvent):
+    __slots__ = ('realTime', 'sysExChannel', 'code', 'subcode', 'payload')
+
+class MIDITimeSignatureEvent(MIDIEvent):
+    __slots__ = ('numerator', 'denominator', 'clocks_per_tick', 'notes_per_quarter')
+
 class GenericEvent(object):
     '''
     The event class from which specific events are derived
     '''
+    __slots__ = ('type', 'time', 'ord', 'insertion_order')
+    
+    # The integer code of the kind of event, set by each derived class.
+    kind = None
+    
     def __init__(self, event_type, time, ordinal, insertion_order):
         self.type = event_type
         self.time = time 
@@ -111,22 +200,31 @@ class GenericEvent(object):
         
         This is needed for the removal of duplicate objects from the event list. The only
         real requirement for the algorithm is that the hash of equal objects must be equal.
-        There is probably great opportunity for improvements in the hashing function.
-        '''
-        # Robert Jenkin's 32 bit hash.
-        a = int(self.time)
-        a = (a+0x7ed55d16) + (a<<12)
-        a = (a^0xc761c23c) ^ (a>>19)
-        a = (a+0x165667b1) + (a<<5)
-        a = (a+0xd3a2646c) ^ (a<<9)
-        a = (a+0xfd7046c5) + (a<<3)
-        a = (a^0xb55a4f09) ^ (a>>16)
-        return a
+        Events of a kind at the same time hash together.
+        '''
+        return hash((self.type, self.time))
+    
+    # Events of the kinds that are never equal to one another are kept as they
+    # are by MIDITrack.removeDuplicates, without being looked up.
+    neverDuplicate = False
+    
+    def dedupeKey(self):
+        '''
+        Return the identity of the event for the removal of duplicates.
+        
+        Two events are equal (see ``__eq__``) if and only if their keys are
+        equal, so the keys can be put in a set instead of the events
+        themselves. Not used for the kinds marked ``neverDuplicate``.
+        '''
+        return (self.type, self.time)
 
 class Note(GenericEvent):
     '''
     A class that encapsulates a note
     '''
+    __slots__ = ('pitch', 'duration', 'volume', 'channel', 'annotation')
+    kind = NOTE_ON
+    
     def __init__(self,channel, pitch,time,duration,volume,ordinal=3,annotation=None, insertion_order=0):
         self.pitch = pitch
         self.duration = duration
@@ -134,19 +232,31 @@ class Note(GenericEvent):
         self.channel = channel
         self.annotation = annotation
         super(Note, self).__init__('note', time, ordinal, insertion_order)
+
+    def dedupeKey(self):
+        return ('note', self.time, self.pitch, self.channel)
         
 class Tempo(GenericEvent):
     '''
     A class that encapsulates a tempo meta-event
     '''
+    __slots__ = ('tempo',)
+    kind = TEMPO
+    
     def __init__(self,time,tempo, ordinal=3, insertion_order=0):
         self.tempo = int(60000000 / tempo)
         super(Tempo, self).__init__('tempo', time, ordinal, insertion_order)
+
+    def dedupeKey(self):
+        return ('tempo', self.time, self.tempo)
         
 class Copyright(GenericEvent):
     '''
     A class that encapsulates a copyright event
     '''
+    __slots__ = ('notice',)
+    kind = COPYRIGHT
+    
     def __init__(self,time,notice, ordinal=1, insertion_order=0):
         self.notice = notice.encode("ISO-8859-1")
         super(Copyright, self).__init__('Copyright', time, ordinal, insertion_order)
@@ -155,6 +265,9 @@ class Text(GenericEvent):
     '''
     A class that encapsulates a text event
     '''
+    __slots__ = ('text',)
+    kind = TEXT
+    
     def __init__(self, time, text, ordinal=1, insertion_order=0):
         self.text = text.encode("ISO-8859-1")
         super(Text, self).__init__('Text', time, ordinal, insertion_order)
@@ -163,6 +276,9 @@ class KeySignature(GenericEvent):
     '''
     A class that encapsulates a text event
     '''
+    __slots__ = ('accidentals', 'accidental_type', 'mode')
+    kind = KEY_SIGNATURE
+    
     def __init__(self, time, accidentals, accidental_type, mode, ordinal=1, insertion_order=0):
         self.accidentals = accidentals
         self.accidental_type = accidental_type
@@ -173,16 +289,24 @@ class ProgramChange(GenericEvent):
     '''
     A class that encapsulates a program change event.
     '''
+    __slots__ = ('programNumber', 'channel')
+    kind = PROGRAM_CHANGE
     
     def __init__(self,  channel,  time,  programNumber, ordinal=1, insertion_order=0):
         self.programNumber = programNumber
         self.channel = channel
         super(ProgramChange, self).__init__('programChange', time, ordinal, insertion_order)
+
+    def dedupeKey(self):
+        return ('programChange', self.time, self.programNumber, self.channel)
         
 class SysExEvent(GenericEvent):
     '''
     A class that encapsulates a System Exclusive  event.
     '''
+    __slots__ = ('manID', 'payload')
+    kind = SYSEX
+    neverDuplicate = True
     
     def __init__(self,  time,  manID,  payload, ordinal=1, insertion_order=0):
         self.manID = manID
@@ -193,6 +317,9 @@ class UniversalSysExEvent(GenericEvent):
     '''
     A class that encapsulates a Universal System Exclusive  event.
     '''
+    __slots__ = ('realTime', 'sysExChannel', 'code', 'subcode', 'payload')
+    kind = UNIVERSAL_SYSEX
+    neverDuplicate = True
     
     def __init__(self,  time,  realTime,  sysExChannel,  code,  subcode,  payload, 
                  ordinal=1, insertion_order=0):
@@ -207,6 +334,9 @@ class ControllerEvent(GenericEvent):
     '''
     A class that encapsulates a program change event.
     '''
+    __slots__ = ('parameter', 'channel', 'controller_number')
+    kind = CONTROLLER
+    neverDuplicate = True
     
     def __init__(self,  channel,  time,  controller_number, parameter, ordinal=1, insertion_order=0):
         self.parameter = parameter
@@ -218,6 +348,9 @@ class PitchWheelEvent(GenericEvent):
     '''
     A class that encapsulates a pitch wheel change event.
     '''
+    __slots__ = ('channel', 'pitch_wheel_value')
+    kind = PITCH_WHEEL
+    neverDuplicate = True
 
     def __init__(self, channel, time, pitch_wheel_value, ordinal=1, insertion_order=0):
         self.channel = channel
@@ -228,9 +361,12 @@ class ChannelPressureEvent(GenericEvent):
     '''
     A class that encapsulates a channel pressure event.
     '''
+    __slots__ = ('channel', 'vibrato_value')
+    kind = CHANNEL_PRESSURE
+    neverDuplicate = True
 
     def __init__(self, channel, time, vibrato, ordinal=1, insertion_order=0):
-        self.chanel = channel
+        self.channel = channel
         self.vibrato_value = vibrato
         super(ChannelPressureEvent, self).__init__('channelPressureEvent', time, ordinal, insertion_order)
 
@@ -238,16 +374,23 @@ class TrackName(GenericEvent):
     '''
     A class that encapsulates a program change event.
     '''
+    __slots__ = ('trackName',)
+    kind = TRACK_NAME
     
     def __init__(self,  time,  trackName, ordinal=0, insertion_order=0):
         #GenericEvent.__init__(self, time,)
         self.trackName = trackName.encode("ISO-8859-1")
         super(TrackName, self).__init__('trackName', time, ordinal, insertion_order)
+
+    def dedupeKey(self):
+        return ('trackName', self.time, self.trackName)
         
 class TimeSignature(GenericEvent):
     '''
     A class that encapsulates a time signature.
     '''
+    __slots__ = ('numerator', 'denominator', 'clocks_per_tick', 'notes_per_quarter')
+    kind = TIME_SIGNATURE
     
     def __init__(self,  time,  numerator, denominator, clocks_per_tick, notes_per_quarter, ordinal=0, insertion_order=0):
         self.numerator = numerator
@@ -256,13 +399,224 @@ class TimeSignature(GenericEvent):
         self.notes_per_quarter = notes_per_quarter
         super(TimeSignature, self).__init__('TimeSignature', time, ordinal, insertion_order)
         
+# The functions that expand a GenericEvent into the MIDI events it stands for,
+# appending them to ``MIDIEventList``, by kind.
+
+def _expandNote(thing, MIDIEventList):
+    event         = MIDINoteEvent("NoteOn", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order, NOTE_ON)
+    event.pitch   = thing.pitch
+    event.volume  = thing.volume
+    event.channel = thing.channel
+    MIDIEventList.append(event)
+
+    event         = MIDINoteEvent("NoteOff", (thing.time+ thing.duration) * TICKSPERBEAT, thing.ord -0.1,
+                                  thing.insertion_order, NOTE_OFF)
+    event.pitch   = thing.pitch
+    event.volume  = thing.volume
+    event.channel = thing.channel
+    MIDIEventList.append(event)
+
+def _expandTempo(thing, MIDIEventList):
+    event = MIDITempoEvent("Tempo", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order, TEMPO)
+    event.tempo = thing.tempo
+    MIDIEventList.append(event)
+
+def _expandCopyright(thing, MIDIEventList):
+    event = MIDICopyrightEvent("Copyright", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order, COPYRIGHT)
+    event.notice = thing.notice
+    MIDIEventList.append(event)
+
+def _expandText(thing, MIDIEventList):
+    event = MIDITextEvent("Text", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order, TEXT)
+    event.text = thing.text
+    MIDIEventList.append(event)
+
+def _expandKeySignature(thing, MIDIEventList):
+    event = MIDIKeySignatureEvent("KeySignature", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order,
+                                  KEY_SIGNATURE)
+    event.accidentals     = thing.accidentals
+    event.accidental_type = thing.accidental_type
+    event.mode            = thing.mode
+    MIDIEventList.append(event)
+
+def _expandProgramChange(thing, MIDIEventList):
+    event               = MIDIProgramChangeEvent("ProgramChange", thing.time * TICKSPERBEAT, thing.ord,
+                                                 thing.insertion_order, PROGRAM_CHANGE)
+    event.programNumber = thing.programNumber
+    event.channel       = thing.channel
+    MIDIEventList.append(event)
+
+def _expandTrackName(thing, MIDIEventList):
+    event = MIDITrackNameEvent("TrackName", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order, TRACK_NAME)
+    event.trackName = thing.trackName
+    MIDIEventList.append(event)
+
+def _expandController(thing, MIDIEventList):
+    event = MIDIControllerEvent("ControllerEvent", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order,
+                                CONTROLLER)
+    event.controller_number = thing.controller_number
+    event.channel = thing.channel
+    event.parameter = thing.parameter
+    MIDIEventList.append(event)
+
+def _expandPitchWheel(thing, MIDIEventList):
+    event = MIDIPitchWheelEvent('PitchWheelEvent', thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order,
+                                PITCH_WHEEL)
+    event.pitch_wheel_value = thing.pitch_wheel_value
+    event.channel = thing.channel
+    MIDIEventList.append(event)
+
+def _expandChannelPressure(thing, MIDIEventList):
+    event = MIDIChannelPressureEvent('ChannelPressureEvent', thing.time * TICKSPERBEAT, thing.ord,
+                                     thing.insertion_order, CHANNEL_PRESSURE)
+    event.vibrato_value = thing.vibrato_value
+    event.channel = thing.channel
+    MIDIEventList.append(event)
+
+def _expandSysEx(thing, MIDIEventList):
+    event = MIDISysExEvent("SysEx", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order, SYSEX)
+    event.manID = thing.manID
+    event.payload = thing.payload
+    MIDIEventList.append(event)
+
+def _expandUniversalSysEx(thing, MIDIEventList):
+    event = MIDIUniversalSysExEvent("UniversalSysEx", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order,
+                                    UNIVERSAL_SYSEX)
+    event.realTime = thing.realTime
+    event.sysExChannel = thing.sysExChannel
+    event.code = thing.code
+    event.subcode = thing.subcode
+    event.payload = thing.payload
+    MIDIEventList.append(event)
+
+def _expandTimeSignature(thing, MIDIEventList):
+    event = MIDITimeSignatureEvent("TimeSignature", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order,
+                                   TIME_SIGNATURE)
+    event.numerator = thing.numerator
+    event.denominator = thing.denominator
+    event.clocks_per_tick = thing.clocks_per_tick
+    event.notes_per_quarter = thing.notes_per_quarter
+    MIDIEventList.append(event)
+
+# The functions that append the encoding of a MIDI event, without its delta
+# time, to ``data``, by kind.
+
+def _encodeNoteOn(event, data):
+    data += _CHANNEL_EVENT.pack(0x9 << 4 | event.channel, event.pitch, event.volume)
+
+def _encodeNoteOff(event, data):
+    data += _CHANNEL_EVENT.pack(0x8 << 4 | event.channel, event.pitch, event.volume)
+
+def _encodeNoteOffAsNoteOn(event, data):
+    data += _CHANNEL_EVENT.pack(0x9 << 4 | event.channel, event.pitch, 0)
+
+def _encodeTempo(event, data):
+    fourbite = struct.pack('>L', event.tempo)
+    threebite = fourbite[1:4]       # Just discard the MSB
+    data += _META_HEADER.pack(0xFF, 0x51, 0x03)
+    data += threebite
+
+def _encodeCopyright(event, data):
+    data += _STATUS_PAIR.pack(0xFF, 0x02)
+    data.extend(writeVarLength(len(event.notice)))
+    data += event.notice
+
+def _encodeText(event, data):
+    data += _STATUS_PAIR.pack(0xFF, 0x01)
+    data.extend(writeVarLength(len(event.text)))
+    data += event.text
+
+def _encodeKeySignature(event, data):
+    data += _META_HEADER.pack(0xFF, 0x59, 0x02)
+    data += _KEY_SIGNATURE.pack(event.accidentals * event.accidental_type, event.mode)
+
+def _encodeProgramChange(event, data):
+    data += _STATUS_PAIR.pack(0xC << 4 | event.channel, event.programNumber)
+
+def _encodeTrackName(event, data):
+    data += _STATUS_PAIR.pack(0xFF, 0x03)
+    data.extend(writeVarLength(len(event.trackName)))
+    data += event.trackName
+
+def _encodeController(event, data):
+    data += _CHANNEL_EVENT.pack(0xB << 4 | event.channel, event.controller_number, event.parameter)
+
+def _encodePitchWheel(event, data):
+    MSB = (event.pitch_wheel_value + 8192) >> 7
+    LSB = (event.pitch_wheel_value + 8192) & 0x7F
+    data += _CHANNEL_EVENT.pack(0xE << 4 | event.channel, LSB, MSB)
+
+def _encodeChannelPressure(event, data):
+    data += _STATUS_PAIR.pack(0xD << 4 | event.channel, event.vibrato_value)
+
+def _encodeSysEx(event, data):
+    data.append(0xF0)
+    data.extend(writeVarLength(len(event.payload)+2))
+    data.append(event.manID)
+    data += event.payload
+    data.append(0xF7)
+
+def _encodeUniversalSysEx(event, data):
+    data.append(0xF0)
+
+    # Do we need to add a length?
+    data.extend(writeVarLength(len(event.payload)+5))
+
+    if event.realTime :
+        data.append(0x7F)
+    else:
+        data.append(0x7E)
+
+    data += _META_HEADER.pack(event.sysExChannel, event.code, event.subcode)
+    data += event.payload
+    data.append(0xF7)
+
+def _encodeTimeSignature(event, data):
+    data += _META_HEADER.pack(0xFF, 0x58, 0x04)
+    data += _TIME_SIGNATURE.pack(event.numerator, event.denominator,
+                                 event.clocks_per_tick,
+                                 event.notes_per_quarter) # 32nd notes per quarter note
+
+def _dispatchTable(functions):
+    table = [None] * len(_MIDI_EVENT_KINDS)
+    for kind, function in functions.items():
+        table[kind] = function
+    return tuple(table)
+
+_EXPANDERS = _dispatchTable({
+    NOTE_ON: _expandNote, TEMPO: _expandTempo, COPYRIGHT: _expandCopyright,
+    TEXT: _expandText, KEY_SIGNATURE: _expandKeySignature,
+    PROGRAM_CHANGE: _expandProgramChange, TRACK_NAME: _expandTrackName,
+    CONTROLLER: _expandController, PITCH_WHEEL: _expandPitchWheel,
+    CHANNEL_PRESSURE: _expandChannelPressure, SYSEX: _expandSysEx,
+    UNIVERSAL_SYSEX: _expandUniversalSysEx, TIME_SIGNATURE: _expandTimeSignature})
+
+_ENCODERS = _dispatchTable({
+    NOTE_ON: _encodeNoteOn, NOTE_OFF: _encodeNoteOff, TEMPO: _encodeTempo,
+    COPYRIGHT: _encodeCopyright, TEXT: _encodeText,
+    KEY_SIGNATURE: _encodeKeySignature, PROGRAM_CHANGE: _encodeProgramChange,
+    TRACK_NAME: _encodeTrackName, CONTROLLER: _encodeController,
+    PITCH_WHEEL: _encodePitchWheel, CHANNEL_PRESSURE: _encodeChannelPressure,
+    SYSEX: _encodeSysEx, UNIVERSAL_SYSEX: _encodeUniversalSysEx,
+    TIME_SIGNATURE: _encodeTimeSignature})
+
+# The same, with note off events written as note on events of velocity 0.
+_NOTE_OFF_AS_NOTE_ON_ENCODERS = (_ENCODERS[:NOTE_OFF] + (_encodeNoteOffAsNoteOn,) +
+                                 _ENCODERS[NOTE_OFF + 1:])
+
 class MIDITrack(object):
     '''
     A class that encapsulates a MIDI track
     '''                        
             
-    def __init__(self, removeDuplicates,  deinterleave):
+    def __init__(self, removeDuplicates,  deinterleave, runningStatus=False,
+                 noteOffAsNoteOn=False):
         '''Initialize the MIDITrack object.
+        
+        With ``runningStatus``, the status byte of a channel event is left out
+        when it is the one of the previous event. With ``noteOffAsNoteOn``,
+        note off events are written as note on events of velocity 0, which
+        makes the runs of a channel's notes share one status.
         '''
         self.headerString = struct.pack('cccc',b'M',b'T',b'r',b'k')
         self.dataLength = 0 # Is calculated after the data is in place
@@ -272,6 +626,24 @@ class MIDITrack(object):
         self.MIDIEventList = []
         self.remdep = removeDuplicates
         self.deinterleave = deinterleave
+        self.runningStatus = runningStatus
+        self.noteOffAsNoteOn = noteOffAsNoteOn
+        self.encoded = False
+        self.firstTime = None # Time of the earliest event, before adjustment
+        
+    def reuseEncoded(self, MIDIdata, firstTime):
+        '''
+        Use the encoded data of a previous export instead of events.
+        
+        ``firstTime`` is the time of the earliest event of the track as it was
+        recorded in ``firstTime`` by that export. It is still needed to find
+        the origin of the file.
+        '''
+        self.MIDIdata = MIDIdata
+        self.dataLength = struct.pack('>L',len(MIDIdata))
+        self.firstTime = firstTime
+        self.closed = True
+        self.encoded = True
         
     def addNoteByNumber(self,channel, pitch,time,duration,volume,annotation=None, 
                         insertion_order=0):
@@ -281,6 +653,17 @@ class MIDITrack(object):
         self.eventList.append(Note(channel, pitch,time,duration,volume,annotation=annotation,
                                    insertion_order = insertion_order))
         
+    def addNotes(self, channel, pitches, times, durations, volumes, insertion_order=0):
+        '''
+        Add notes given as parallel sequences of pitches, times, durations and
+        volumes. The notes are numbered in order from ``insertion_order``.
+        '''
+        self.eventList.extend([Note(channel, pitch, time, duration, volume,
+                                    insertion_order=order)
+                               for order, pitch, time, duration, volume in
+                               zip(itertools.count(insertion_order), pitches, times,
+                                   durations, volumes)])
+        
     def addControllerEvent(self,channel,time,controller_number, parameter, insertion_order=0):
         '''
         Add a controller event.
@@ -384,105 +767,20 @@ class MIDITrack(object):
         list are created.
         '''
         
-        # Loop over all items in the eventList
+        # Each item is expanded by the function registered for its kind.
         
+        expanders = _EXPANDERS
+        MIDIEventList = self.MIDIEventList
         for thing in self.eventList:
-            if thing.type == 'note':
-                event         = MIDIEvent("NoteOn", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order)
-                event.pitch   = thing.pitch
-                event.volume  = thing.volume
-                event.channel = thing.channel
-                self.MIDIEventList.append(event)
-
-                event         = MIDIEvent("NoteOff", (thing.time+ thing.duration) * TICKSPERBEAT, thing.ord -0.1,
-                                            thing.insertion_order)
-                event.pitch   = thing.pitch
-                event.volume  = thing.volume
-                event.channel = thing.channel
-                self.MIDIEventList.append(event)
-
-            elif thing.type == 'tempo':
-                event = MIDIEvent("Tempo", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order)
-                event.tempo = thing.tempo
-                self.MIDIEventList.append(event)
-                
-            elif thing.type == 'Copyright':
-                event = MIDIEvent("Copyright", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order)
-                event.notice = thing.notice
-                self.MIDIEventList.append(event)
-                
-            elif thing.type == 'Text':
-                event = MIDIEvent("Text", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order)
-                event.text = thing.text
-                self.MIDIEventList.append(event)
-                
-            elif thing.type == 'KeySignature':
-                event = MIDIEvent("KeySignature", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order)
-                event.accidentals     = thing.accidentals
-                event.accidental_type = thing.accidental_type
-                event.mode            = thing.mode
-                self.MIDIEventList.append(event)
-                
-            elif thing.type == 'programChange':
-                event               = MIDIEvent("ProgramChange", thing.time * TICKSPERBEAT, thing.ord, 
-                                                thing.insertion_order)
-                event.programNumber = thing.programNumber
-                event.channel       = thing.channel
-                self.MIDIEventList.append(event)
-
-            elif thing.type == 'trackName':
-                event = MIDIEvent("TrackName", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order)
-                event.trackName = thing.trackName
-                self.MIDIEventList.append(event)
-
-            elif thing.type == 'controllerEvent':
-                event = MIDIEvent("ControllerEvent", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order)
-                event.controller_number = thing.controller_number
-                event.channel = thing.channel
-                event.parameter = thing.parameter
-                self.MIDIEventList.append(event)
-
-            elif thing.type == 'pitchWheelEvent':
-                event = MIDIEvent('PitchWheelEvent', thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order)
-                event.pitch_wheel_value = thing.pitch_wheel_value
-                event.channel = thing.channel
-                self.MIDIEventList.append(event)
-
-            elif thing.type == 'channelPressureEvent':
-                event = MIDIEvent('ChannelPressureEvent', thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order)
-                event.vibrato_value = thing.vibrato_value
-                event.channel = thing.channel
-                self.MIDIEventList.append(event)
-
-
-            elif thing.type == 'SysEx':
-                event = MIDIEvent("SysEx", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order)
-                event.manID = thing.manID
-                event.payload = thing.payload
-                self.MIDIEventList.append(event)
-
-            elif thing.type == 'UniversalSysEx':
-                event = MIDIEvent("UniversalSysEx", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order)
-                event.realTime = thing.realTime
-                event.sysExChannel = thing.sysExChannel
-                event.code = thing.code
-                event.subcode = thing.subcode
-                event.payload = thing.payload
-                self.MIDIEventList.append(event)
-                
-            elif thing.type == 'TimeSignature':
-                event = MIDIEvent("TimeSignature", thing.time * TICKSPERBEAT, thing.ord, thing.insertion_order)
-                event.numerator = thing.numerator
-                event.denominator = thing.denominator
-                event.clocks_per_tick = thing.clocks_per_tick
-                event.notes_per_quarter = thing.notes_per_quarter
-                self.MIDIEventList.append(event)
-
-            else:
+            if thing.kind is None:
                 raise ValueError("Error in MIDITrack: Unknown event type %s" % thing.type)
+            expanders[thing.kind](thing, MIDIEventList)
             
-        # Assumptions in the code expect the list to be time-sorted.
-        self.MIDIEventList.sort(key=sort_events)
+        # Assumptions in the code expect the list to be time-sorted. This is the
+        # only full sort of the track: the events of each source (a note lane,
+        # an automation lane) already come in runs ordered in time, which the
+        # sort merges rather than sorting from scratch.
+        self.MIDIEventList.sort(key=_SORT_KEY)
 
         if self.deinterleave:    
             self.deInterleaveNotes()
@@ -495,18 +793,27 @@ class MIDITrack(object):
         because we the MIDI event stream can become confused otherwise.
         '''
         
-        # For this algorithm to work, the events in the eventList must be hashable 
-        # (that is, they must have a __hash__() and __eq__() function defined).
+        # The first of equal events is kept. Events are compared through their
+        # dedupeKey(), and the kinds of events that are never equal skip the
+        # lookup altogether.
 
-        tempDict = {}
+        seen = set()
+        eventList = []
         for item in self.eventList:
-            tempDict[item] = 1
+            if not item.neverDuplicate:
+                key = item.dedupeKey()
+                if key in seen:
+                    continue
+                seen.add(key)
+            eventList.append(item)
             
-        self.eventList = list(tempDict.keys())
-        
-        self.eventList.sort(key=sort_events)
+        # The eventList is left in the order the events were added; only
+        # the MIDIEventList is sorted, by processEventList.
+        self.eventList = eventList
 
 
+    @profiling.stage('MIDITrack.closeTrack',
+                     lambda args, result: len(args[0].MIDIEventList), 'events')
     def closeTrack(self):
         '''
         Called to close a track before writing
@@ -546,204 +853,71 @@ class MIDITrack(object):
         
         self.dataLength = struct.pack('>L',len(self.MIDIdata))
 
-    def writeEventsToStream(self):
+    @profiling.stage('MIDITrack.writeEventsToStream',
+                     lambda args, result: len(args[0].MIDIEventList), 'events')
+    def writeEventsToStream(self, fileHandle=None):
         '''
         Write the events in MIDIEvents to the MIDI stream.
+        
+        If ``fileHandle`` is given, the events are written to it as they are
+        encoded, a batch at a time, instead of to MIDIdata, and the number of
+        bytes written is returned.
         '''
+        data = bytearray(self.MIDIdata)
+        if self.noteOffAsNoteOn:
+            encoders = _NOTE_OFF_AS_NOTE_ON_ENCODERS
+        else:
+            encoders = _ENCODERS
+        runningStatus = self.runningStatus
+        running = None                      # The status byte in effect
         preciseTime = 0.0                   # Actual time of event, ignoring round-off
         actualTime = 0.0                    # Time as written to midi stream, include round-off
-        for event in self.MIDIEventList:
-
-            preciseTime = preciseTime + event.time
-
-            # Convert the time to variable length and back, to see how much
-            # error is introduced
-
-            testBuffer = b""
-            varTime = writeVarLength(event.time)
-            for timeByte in varTime:
-                testBuffer = testBuffer + struct.pack('>B',timeByte)
-            (roundedVal,discard) = readVarLength(0,testBuffer)
-            roundedTime = actualTime + roundedVal
-
-            # Calculate the delta between the two and apply it to the event time.
-
-            delta = preciseTime - roundedTime
-            event.time = event.time + delta
-
-            # Now update the actualTime value, using the updated event time.
-
-            testBuffer = b""
-            varTime = writeVarLength(event.time)
-            for timeByte in varTime:
-                testBuffer = testBuffer + struct.pack('>B',timeByte)
-
-            (roundedVal,discard) = readVarLength(0,testBuffer)
-            actualTime = actualTime + roundedVal
-        
-        for event in self.MIDIEventList:
-            if event.type == "NoteOn":
-                code = 0x9 << 4 | event.channel
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.pitch)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.volume)
-            elif event.type == "NoteOff":
-                code = 0x8 << 4 | event.channel
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.pitch)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.volume)
-            elif event.type == "Tempo":
-                code = 0xFF
-                subcode = 0x51
-                fourbite = struct.pack('>L', event.tempo)
-                threebite = fourbite[1:4]       # Just discard the MSB
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',subcode)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', 0x03)
-                self.MIDIdata = self.MIDIdata + threebite
-            elif event.type == "Text":
-                code = 0xFF
-                subcode = 0x01
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)                
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',subcode)
-                payloadLength = len(event.text)
-                payloadLengthVar = writeVarLength(payloadLength)
-                for i in range(len(payloadLengthVar)):
-                    self.MIDIdata = self.MIDIdata + struct.pack("b",payloadLengthVar[i])
-                self.MIDIdata = self.MIDIdata + event.text
-            elif event.type == "Copyright":
-                code = 0xFF
-                subcode = 0x02
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)                
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',subcode)
-                payloadLength = len(event.notice)
-                payloadLengthVar = writeVarLength(payloadLength)
-                for i in range(len(payloadLengthVar)):
-                    self.MIDIdata = self.MIDIdata + struct.pack("b",payloadLengthVar[i])
-                self.MIDIdata = self.MIDIdata + event.notice
-            elif event.type == "TimeSignature":
-                code = 0xFF
-                subcode = 0x58
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',subcode)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', 0x04)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', event.numerator)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', event.denominator)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', event.clocks_per_tick)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', event.notes_per_quarter) # 32nd notes per quarter note
-            elif event.type == "KeySignature":
-                code = 0xFF
-                subcode = 0x59
-                event_subtype = 0x02
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',subcode)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event_subtype)
-                self.MIDIdata = self.MIDIdata + struct.pack('>b',event.accidentals * event.accidental_type)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.mode)
-            elif event.type == 'ProgramChange':
-                code = 0xC << 4 | event.channel
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.programNumber)
-            elif event.type == 'TrackName':
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('B',0xFF)
-                self.MIDIdata = self.MIDIdata + struct.pack('B',0X03)
-                dataLength = len(event.trackName)
-                dataLenghtVar = writeVarLength(dataLength)
-                for i in range(0,len(dataLenghtVar)):
-                    self.MIDIdata = self.MIDIdata + struct.pack("b",dataLenghtVar[i])
-                self.MIDIdata = self.MIDIdata + event.trackName
-            elif event.type == "ControllerEvent":
-                code = 0xB << 4 | event.channel
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.controller_number)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.parameter)
-
-            elif event.type == 'PitchWheelEvent':
-                code = 0xE << 4 | event.channel
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-
-                MSB = (event.pitch_wheel_value + 8192) >> 7
-                LSB = (event.pitch_wheel_value + 8192) & 0x7F
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',LSB)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',MSB)
-
-            elif event.type == 'ChannelPressureEvent':
-                code = 0xD << 4 | event.channel
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.vibrato_value)
-
-            elif event.type == "SysEx":
-                code = 0xF0
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', code)
-                
-                payloadLength = writeVarLength(len(event.payload)+2)
-                for lenByte in payloadLength:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',lenByte)
-                    
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', event.manID)
-                self.MIDIdata = self.MIDIdata + event.payload
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',0xF7)
-            elif event.type == "UniversalSysEx":
-                code = 0xF0
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', code)
+        events = self.MIDIEventList
+        if fileHandle is None:
+            batches = (events,)
+        else:
+            batches = (events[i:i + _STREAM_BATCH]
+                       for i in range(0, len(events), _STREAM_BATCH))
+        written = 0
+        for batch in batches:
+            for event in batch:
+
+                # Delta times are written as whole ticks. The round-off of the
+                # events written so far is carried over to this one, so that the
+                # error does not accumulate along the track.
+
+                preciseTime = preciseTime + event.time
+                delta = preciseTime - (actualTime + int(event.time + 0.5))
+                event.time = event.time + delta
+                ticks = int(event.time + 0.5)
+                actualTime = actualTime + ticks
+                data += varLengthBytes(ticks)
+
+                if not runningStatus:
+                    encoders[event.kind](event, data)
+                    continue
                 
-                # Do we need to add a length?
-                payloadLength = writeVarLength(len(event.payload)+5)
-                for lenByte in payloadLength:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',lenByte)
+                # The status byte is dropped when it repeats the one in
+                # effect. Meta and system exclusive events cancel it.
                 
-                if event.realTime :
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B', 0x7F)
+                position = len(data)
+                encoders[event.kind](event, data)
+                status = data[position]
+                if status >= 0xF0:
+                    running = None
+                elif status == running:
+                    del data[position]
                 else:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B', 0x7E)
-                    
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', event.sysExChannel)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', event.code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', event.subcode)
-                self.MIDIdata = self.MIDIdata + event.payload
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',0xF7)
+                    running = status
+
+            if fileHandle is not None:
+                fileHandle.write(data)
+                written += len(data)
+                del data[:]
+
+        if fileHandle is None:
+            self.MIDIdata = bytes(data)
+        return written
         
     def deInterleaveNotes(self):
         '''
@@ -755,34 +929,67 @@ class MIDITrack(object):
         MIDIEventList has been time-ordered.
         '''
         
+        # The start times of the sounding notes, indexed by channel << 7 | pitch.
+        stacks = [[] for _ in range(16 * 128)]
         tempEventList = []
-        stack = {}
+        movedEvents = []
         
         for event in self.MIDIEventList:
             
-            if event.type == 'NoteOn':
-                if str(event.pitch)+str(event.channel) in stack:
-                    stack[str(event.pitch)+str(event.channel)].append(event.time)
-                else:
-                    stack[str(event.pitch)+str(event.channel)] = [event.time]
+            if event.kind == NOTE_ON:
+                stacks[event.channel << 7 | event.pitch].append(event.time)
                 tempEventList.append(event)
-            elif event.type == 'NoteOff':
-                if len(stack[str(event.pitch)+str(event.channel)]) > 1:
-                    event.time = stack[str(event.pitch)+str(event.channel)].pop()
-                    tempEventList.append(event)
+            elif event.kind == NOTE_OFF:
+                stack = stacks[event.channel << 7 | event.pitch]
+                if len(stack) > 1:
+                    event.time = stack.pop()
+                    movedEvents.append(event)
                 else:
-                    stack[str(event.pitch)+str(event.channel)].pop()
+                    stack.pop()
                     tempEventList.append(event)
             else:
                 tempEventList.append(event)
-                    
+        
+        # Only the note off events that were moved can be out of order; they
+        # are merged back into the rest, which is still sorted. Note that
+        # ``processEventList`` makes the ordinality of a note off event a bit
+        # lower than the note on event, so concomitant note off events are
+        # processed first.
+        
+        if movedEvents:
+            movedEvents.sort(key=_SORT_KEY)
+            tempEventList = list(heapq.merge(tempEventList, movedEvents, key=_SORT_KEY))
         self.MIDIEventList = tempEventList
+
+    def earliestTime(self):
+        '''
+        Return the time, in ticks, of the earliest event the track will have
+        once closed, or ``None`` if it has no events.
         
-        # Note that ``processEventList`` makes the ordinality of a note off event
-        # a bit lower than the note on event, so this sort will make concomitant
-        # note off events processed first.
+        This is the time of the first event of the sorted MIDIEventList, but
+        it is found from the eventList, without closing the track.
+        '''
+        if not self.eventList:
+            return None
+        earliest = min(event.time for event in self.eventList)
+        for event in self.eventList:
+            if event.kind == NOTE_ON and event.time + event.duration < earliest:
+                earliest = event.time + event.duration
+        return earliest * TICKSPERBEAT
+
+    def encode(self, origin, adjust):
+        '''
+        Close the track and encode its events, shifted to ``origin``.
         
-        self.MIDIEventList.sort(key=sort_events)
+        Returns the encoded data and the time of the earliest event, which
+        is all that is needed of a track encoded in another process.
+        '''
+        self.closeTrack()
+        if len(self.MIDIEventList) > 0:
+            self.firstTime = self.MIDIEventList[0].time
+        self.adjustTimeAndOrigin(origin, adjust)
+        self.writeMIDIStream()
+        return self.MIDIdata, self.firstTime
 
     def adjustTimeAndOrigin(self,origin, adjust):
         '''
@@ -820,6 +1027,40 @@ class MIDITrack(object):
         fileHandle.write(self.dataLength)
         fileHandle.write(self.MIDIdata)
 
+    def writeStreamed(self, fileHandle, origin, adjust):
+        '''
+        Close the track, shift it to ``origin`` and write it to disk as it is
+        encoded, then free its events and data.
+        
+        The length of the chunk is written last, seeking back to its place in
+        the header, so that the encoded track is never held in memory. A file
+        handle that can't seek gets the track encoded in MIDIdata first, as
+        ``writeTrack`` does.
+        '''
+        if not self.encoded:
+            self.closeTrack()
+            self.eventList = []
+            if len(self.MIDIEventList) > 0:
+                self.firstTime = self.MIDIEventList[0].time
+            self.adjustTimeAndOrigin(origin, adjust)
+            if fileHandle.seekable():
+                fileHandle.write(self.headerString)
+                lengthPosition = fileHandle.tell()
+                fileHandle.write(struct.pack('>L', 0))
+                length = self.writeEventsToStream(fileHandle)
+                fileHandle.write(struct.pack('BBBB',0x00,0xFF,0x2F,0x00))
+                end = fileHandle.tell()
+                fileHandle.seek(lengthPosition)
+                fileHandle.write(struct.pack('>L', length + 4))
+                fileHandle.seek(end)
+                self.MIDIEventList = []
+                self.closed = True
+                return
+            self.writeMIDIStream()
+            self.MIDIEventList = []
+        self.writeTrack(fileHandle)
+        self.MIDIdata = b""
+
 
 class MIDIHeader(object):
     '''
@@ -863,7 +1104,8 @@ class MIDIFile(object):
     and well-formed MIDI file.
     '''
     
-    def __init__(self, numTracks=1, removeDuplicates=True,  deinterleave=True, adjust_origin=None, file_format=1):
+    def __init__(self, numTracks=1, removeDuplicates=True,  deinterleave=True, adjust_origin=None, file_format=1,
+                 running_status=False, note_off_as_note_on=False):
         '''
         
             Initialize the MIDIFile class
@@ -876,6 +1118,10 @@ class MIDIFile(object):
                 events in the tracks so that the first event takes place at time t=0
             :param file_format: The format of the multi-track file. This should either be ``1`` (the default,
                 and the most widely supported format) or ``2``.
+            :param running_status: If set to ``True`` use running status, leaving out the status byte of
+                channel events that repeat the status of the previous event.
+            :param note_off_as_note_on: If set to ``True`` write note off events as note on events of
+                velocity 0. Combined with ``running_status``, this lets the notes of a channel share a status.
                 
             Note that the default for ``adjust_origin`` will change in a future release, so one should probably
             explicitly set it.
@@ -914,6 +1160,7 @@ class MIDIFile(object):
             delta = 0
         self.numTracks = numTracks + delta
         self.closed = False
+        self.origin = None
         if adjust_origin is None:
             self.adjust_origin = True
             warnings.warn("Please explicitly set adjust_origin. Default behaviour will change in a future version.", 
@@ -922,7 +1169,8 @@ class MIDIFile(object):
             self.adjust_origin = adjust_origin
         
         for i in range(0,self.numTracks):
-            self.tracks.append(MIDITrack(removeDuplicates,  deinterleave))
+            self.tracks.append(MIDITrack(removeDuplicates,  deinterleave, running_status,
+                                         note_off_as_note_on))
             
         self.event_counter = 0 # to keep track of the order of insertion for new sorting
             
@@ -955,6 +1203,28 @@ class MIDIFile(object):
             annotation = annotation, insertion_order = self.event_counter)
         self.event_counter = self.event_counter + 1
 
+    def addNotes(self, track, channel, pitches, times, durations, volumes):
+        """
+        
+        Add many notes to the MIDIFile object at once
+        
+        :param track: The track to which the notes are added.
+        :param channel: the MIDI channel to assign to the notes. [Integer, 0-15]
+        :param pitches: the MIDI pitch numbers [Sequence of Integers, 0-127].
+        :param times: the times (in beats) at which the notes sound [Sequence of Floats].
+        :param durations: the durations of the notes (in beats) [Sequence of Floats].
+        :param volumes: the volumes (velocities) of the notes. [Sequence of Integers, 0-127].
+        
+        This is equivalent to calling ``addNote`` for each note in turn, without
+        the cost of one method call per note.
+        """
+        if self.header.numeric_format == 1:
+            track = track + 1
+        count = len(pitches)
+        self.tracks[track].addNotes(channel, pitches, times, durations, volumes,
+                                    insertion_order = self.event_counter)
+        self.event_counter = self.event_counter + count
+
     def addTrackName(self,track, time,trackName):
         """
         Name a track.
@@ -1390,15 +1660,30 @@ class MIDIFile(object):
                                                realTime, insertion_order = self.event_counter)
         self.event_counter = self.event_counter + 1
 
-    def writeFile(self,fileHandle):
+    @profiling.stage('MIDIFile.writeFile',
+                     lambda args, result: args[1].tell() if args[1].seekable() else 0,
+                     'bytes')
+    def writeFile(self,fileHandle, stream=False):
         '''
         Write the MIDI File.
         
         :param fileHandle: A file handle that has been opened for binary writing.
+        :param stream: If True, and the file hasn't been closed yet, each track
+            is closed and encoded as it is written, and its events and data
+            are freed before the next one, so that only one track is held in
+            encoded form at a time. The output is the same, but the tracks
+            are left empty.
         '''
         
         self.header.writeFile(fileHandle)
         
+        if stream and not self.closed:
+            self.origin = self.eventListOrigin()
+            for track in self.tracks:
+                track.writeStreamed(fileHandle, self.origin, self.adjust_origin)
+            self.closed = True
+            return
+        
         #Close the tracks and have them create the MIDI event data structures.
         self.close()
         
@@ -1436,32 +1721,109 @@ class MIDIFile(object):
 
     #End Public Functions ########################
     
-    def close(self):
+    def close(self, jobs=None):
         '''
         Close the MIDIFile for further writing.
         
         To close the File for events, we must close the tracks, adjust the time to be
         zero-origined, and have the tracks write to their MIDI Stream data structure.
+        
+        :param jobs: If greater than one, the tracks are closed and encoded on a
+            pool of that many processes. The output is the same as when they
+            are processed one after another. Either way the tracks keep their
+            eventLists and get their MIDIdata, dataLength and firstTime, which
+            are what ``writeFile`` and ``reuseEncoded`` need. Only the tracks
+            closed in this process get a MIDIEventList, though, so the origin
+            of a parallel close is kept in ``origin`` and can't be found again
+            by ``findOrigin``.
         '''
         
         if self.closed == True:
             return
+        self._close(jobs)
+    
+    @profiling.stage('MIDIFile.close',
+                     lambda args, result: sum(len(track.eventList) for track in args[0].tracks),
+                     'events')
+    def _close(self, jobs):
+        '''
+        Close the tracks of a MIDIFile that isn't closed yet (see ``close``).
+        
+        Profiled as a stage, unlike ``close``, so that the calls that have
+        nothing left to do aren't counted.
+        '''
+        if jobs is not None and jobs > 1:
+            self.closeParallel(jobs)
+            return
                 
         for i in range(0,self.numTracks):
+            if self.tracks[i].encoded:
+                continue
+            # The MIDIEventList comes out of closeTrack sorted, with things like program
+            # changes before notes when they are at the same time.
             self.tracks[i].closeTrack()
-            # We want things like program changes to come before notes when they are at the
-            # same time, so we sort the MIDI events by their ordinality
-            self.tracks[i].MIDIEventList.sort(key=sort_events)
+            if len(self.tracks[i].MIDIEventList) > 0:
+                self.tracks[i].firstTime = self.tracks[i].MIDIEventList[0].time
             
         origin = self.findOrigin()
+        self.origin = origin
 
         for i in range(0,self.numTracks):
+            if self.tracks[i].encoded:
+                continue
             self.tracks[i].adjustTimeAndOrigin(origin, self.adjust_origin)
             self.tracks[i].writeMIDIStream()
             
         self.closed = True
     
     
+    def closeParallel(self, jobs):
+        '''
+        Close the tracks on a pool of ``jobs`` processes.
+        
+        The origin is found from the eventLists first, so that each track can
+        then be closed, shifted and encoded independently of the others.
+        
+        The workers close copies of the tracks. The tracks in this process
+        keep their eventList and their MIDIEventList as it was (empty, since
+        it is only built by ``closeTrack``), and get the MIDIdata,
+        dataLength and firstTime of their copy. ``encoded`` stays False, as
+        it marks the tracks of a previous export (see ``reuseEncoded``).
+        '''
+        origin = self.eventListOrigin()
+        self.origin = origin
+        
+        pending = [track for track in self.tracks if not track.encoded]
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pending) or 1)) as executor:
+            results = executor.map(_encodeTrack, pending,
+                                   itertools.repeat(origin),
+                                   itertools.repeat(self.adjust_origin),
+                                   itertools.repeat(profiling.enabled))
+            for track, (MIDIdata, firstTime, records) in zip(pending, results):
+                if records is not None:
+                    profiling.merge(records)
+                track.MIDIdata = MIDIdata
+                track.dataLength = struct.pack('>L',len(MIDIdata))
+                track.firstTime = firstTime
+                track.closed = True
+            
+        self.closed = True
+    
+    def eventListOrigin(self):
+        '''
+        Find the earliest time in the file's tracks from their eventLists,
+        before they are closed.
+        '''
+        origin = 1000000 # The same default as findOrigin
+        for track in self.tracks:
+            if track.encoded:
+                earliest = track.firstTime
+            else:
+                earliest = track.earliestTime()
+            if earliest is not None and earliest < origin:
+                origin = earliest
+        return origin
+    
     def findOrigin(self):
         '''
         Find the earliest time in the file's tracks.append.
@@ -1476,10 +1838,31 @@ class MIDIFile(object):
                 if len(track.MIDIEventList) > 0:
                     if track.MIDIEventList[0].time < origin:
                         origin = track.MIDIEventList[0].time
+                elif track.encoded and track.firstTime is not None:
+                    if track.firstTime < origin:
+                        origin = track.firstTime
                         
         
         return origin
             
+def _encodeTrack(track, origin, adjust, profile=False):
+    '''
+    Encode a track in a worker process of ``MIDIFile.closeParallel``.
+    
+    Returns the encoded data, the time of the earliest event and, if
+    ``profile`` is True, the records of the profiling stages run in the
+    worker for this track, for the parent process to merge into its own.
+    '''
+    if not profile:
+        return track.encode(origin, adjust) + (None,)
+    # Also clears the records a forked worker inherits from its parent.
+    profiling.enable()
+    try:
+        MIDIdata, firstTime = track.encode(origin, adjust)
+        return MIDIdata, firstTime, profiling.records()
+    finally:
+        profiling.disable()
+
 def writeVarLength(i):
     '''
     Accept an input, and write a MIDI-compatible variable length stream
@@ -1510,6 +1893,23 @@ def writeVarLength(i):
     reversed[3] = output[0]
     return reversed[4-count:4]
 
+# Encoded variable length quantities for everything that fits in two bytes,
+# which covers the delta times of nearly every event in a track.
+
+_VARLENGTH_TABLE = tuple([bytes((i,)) for i in range(0x80)] +
+                         [bytes((0x80 | i >> 7, i & 0x7F)) for i in range(0x80, 0x4000)])
+
+def varLengthBytes(i):
+    '''
+    Return the variable length encoding of the integer ``i`` as bytes.
+    
+    This is equivalent to ``writeVarLength``, but looks the common small values
+    up in a table.
+    '''
+    if 0 <= i < 0x4000:
+        return _VARLENGTH_TABLE[i]
+    return bytes(writeVarLength(i))
+
 # readVarLength is taken from the MidiFile class.
 
 def readVarLength(offset, buffer):
@@ -1586,6 +1986,8 @@ def sort_events(event):
           they were originally added to the list. Thus, for example, if one is making
           an RPN call one can specify the controller change events in the proper order
           and be sure that they will end up in the file that way.
+          
+        The tracks sort with ``_SORT_KEY``, which builds the same key.
     '''
     
     return (event.time, event.ord, event.insertion_order)
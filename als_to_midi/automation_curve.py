@@ -1,4 +1,9 @@
-# import matplotlib.pyplot as plt
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 def de_casteljau(points, u, k=None, i=None, dim=None) -> list:
@@ -39,8 +44,36 @@ def de_casteljau(points, u, k=None, i=None, dim=None) -> list:
     return result
 
 
-def b_curve(time1, value1, time2, value2, cc_x, cc_y, q) -> dict:
-    points = {}
+def bernstein(points, u) -> tuple:
+    """Return the point of a cubic Bezier curve at the local coordinate u,
+    using the closed Bernstein form.
+
+    u may be a float or a NumPy array, in which case the coordinates of all
+    the points are computed at once.
+
+    Args:
+    points -- the four control points, as [[x, y], ...]
+    u -- local coordinate on the curve: $u \\in [0,1]$
+    """
+    mu = 1 - u
+    b0 = mu * mu * mu
+    b1 = 3 * mu * mu * u
+    b2 = 3 * mu * u * u
+    b3 = u * u * u
+    return (b0 * points[0][0] + b1 * points[1][0] + b2 * points[2][0] +
+            b3 * points[3][0],
+            b0 * points[0][1] + b1 * points[1][1] + b2 * points[2][1] +
+            b3 * points[3][1])
+
+
+def b_curve(time1, value1, time2, value2, cc_x, cc_y, q,
+            truncate=True) -> tuple:
+    """Sample the curve between two automation points every q beats.
+
+    Returns the times and the values of the samples, truncated unless
+    truncate is False, as two arrays: NumPy arrays when NumPy is available,
+    array.array otherwise.
+    """
     delta_time = time2 - time1
     delta_value = value2 - value1
     points_num = int(delta_time / q)
@@ -48,41 +81,169 @@ def b_curve(time1, value1, time2, value2, cc_x, cc_y, q) -> dict:
          [time1 + cc_x * delta_time, value1 + cc_y * delta_value],
          [time1 + delta_time * cc_x, value1 + cc_y * delta_value],
          [time2, value2]]
-    x = []
-    y = []
+
+    if np is not None:
+        u = np.arange(points_num) / points_num
+        x, y = bernstein(p, u)
+        return x.astype(np.float64), np.trunc(y) if truncate else y
+
+    times = array('d')
+    values = array('d')
     for point in range(0, points_num):
-        # p = point / points_num
-        coor = de_casteljau(p, p)
-        points[point] = {'Time': float(coor[0]), 'Value': int(coor[1])}
-        # print(point, points[point])
-        x.append(coor[0])
-        y.append(coor[1])
+        x, y = bernstein(p, point / points_num)
+        times.append(x)
+        values.append(int(y) if truncate else y)
 
-    # verification graphic
-    # plt.plot(x, y, marker='o')
-    # plt.show()
+    return times, values
 
-    return points
 
+def affine(time1, value1, time2, value2, q, truncate=True) -> tuple:
+    """Sample the line between two automation points every q beats, the
+    end point included.
 
-def affine(time1, value1, time2, value2, q) -> dict:
-    points = {}
+    Returns the times and the values of the samples as two arrays, like
+    b_curve.
+    """
     a = float((float(value2) - float(value1)) / (float(time2) - float(time1)))
     b = value1 - a * time1
-    # print('coefficient:', a)
-    # print('test: a * {} = {}'.format(time1, a*time1))
 
     delta_time = time2 - time1
     points_num = int(delta_time / q)
-    for point in range(1, points_num + 1):
-        p = point * delta_time / points_num + time1
-        # print('test: a * {} = {}'.format(p, a * p))
-        points[point] = {'Time': float(p), 'Value': int(a * p + b)}
-        # print(point, points[point])
-
-    # print('test: a * {} = {}'.format(time2, a * time2))
-    # print('time:', time, 'nombre de points générés:', points_num,"\n")
 
-    return points
+    if np is not None:
+        p = np.arange(1, points_num + 1) * delta_time / points_num + time1
+        y = a * p + b
+        return p.astype(np.float64), np.trunc(y) if truncate else y
 
-# bCurve(0,0,4,127,0,1,0.25)
+    times = array('d')
+    values = array('d')
+    for point in range(1, points_num + 1):
+        p = point * delta_time / points_num + time1
+        times.append(p)
+        values.append(int(a * p + b) if truncate else a * p + b)
+
+    return times, values
+
+
+def split(points) -> tuple:
+    """Split a cubic Bezier curve at u = 0.5 with de Casteljau's construction,
+    returning the control points of the two halves."""
+    (x0, y0), (x1, y1), (x2, y2), (x3, y3) = points
+    x01, y01 = (x0 + x1) / 2, (y0 + y1) / 2
+    x12, y12 = (x1 + x2) / 2, (y1 + y2) / 2
+    x23, y23 = (x2 + x3) / 2, (y2 + y3) / 2
+    xa, ya = (x01 + x12) / 2, (y01 + y12) / 2
+    xb, yb = (x12 + x23) / 2, (y12 + y23) / 2
+    xm, ym = (xa + xb) / 2, (ya + yb) / 2
+    return (((x0, y0), (x01, y01), (xa, ya), (xm, ym)),
+            ((xm, ym), (xb, yb), (x23, y23), (x3, y3)))
+
+
+def flatten(points, tolerance, level, resolution, times, values) -> None:
+    """Append to times and values the points of the curve where its level
+    moves tolerance or more away from the level of the last value appended.
+
+    level maps a value to what is written in the MIDI file, and must be
+    monotonic. The curve is split until its pieces are resolution beats
+    long, but only the pieces that can hold such a point are split: as a
+    Bezier curve lies within the hull of its control points, a piece whose
+    control points all have levels close to the last one is skipped.
+    """
+    last = level(values[-1])
+    pieces = [points]
+    while pieces:
+        (x0, y0), (x1, y1), (x2, y2), (x3, y3) = points = pieces.pop()
+        if abs(level(min(y0, y1, y2, y3)) - last) < tolerance and \
+                abs(level(max(y0, y1, y2, y3)) - last) < tolerance:
+            continue
+        if x3 - x0 <= resolution:
+            end_level = level(y3)
+            if abs(end_level - last) >= tolerance:
+                times.append(x3)
+                values.append(y3)
+                last = end_level
+            continue
+        first, second = split(points)
+        pieces.append(second)
+        pieces.append(first)
+
+
+def written_level(level, truncate: bool):
+    """The level of a value as written: the level of the truncated value,
+    unless truncate is False."""
+    if not truncate:
+        return level
+    return lambda value: level(int(value))
+
+
+def truncated(values, truncate: bool):
+    if not truncate:
+        return values
+    return array('d', [int(value) for value in values])
+
+
+def adaptive_b_curve(time1, value1, time2, value2, cc_x, cc_y, tolerance=1,
+                     level=int, resolution=1 / 960, truncate=True) -> tuple:
+    """Sample the curve between two automation points only where its level
+    changes by tolerance or more, e.g. where it crosses an integer for the
+    default tolerance and level.
+
+    Like b_curve, the first point is included and the end point is not,
+    and the values are truncated unless truncate is False, the level being
+    that of the truncated values then. The points are placed within
+    resolution beats after the changes.
+    """
+    delta_time = time2 - time1
+    delta_value = value2 - value1
+    p = ((time1, value1),
+         (time1 + cc_x * delta_time, value1 + cc_y * delta_value),
+         (time1 + delta_time * cc_x, value1 + cc_y * delta_value),
+         (time2, value2))
+    times = array('d', [time1])
+    values = array('d', [value1])
+    flatten(p, tolerance, written_level(level, truncate), resolution, times,
+            values)
+    if times[-1] >= time2:
+        times.pop()
+        values.pop()
+    return times, truncated(values, truncate)
+
+
+def adaptive_affine(time1, value1, time2, value2, tolerance=1, level=int,
+                    resolution=1 / 960, truncate=True) -> tuple:
+    """Sample the line between two automation points only where its level
+    changes by tolerance or more.
+
+    Like affine, the first point is left out and the end point is included
+    when its level differs from the first point's. The values are truncated
+    like those of adaptive_b_curve.
+    """
+    delta_time = time2 - time1
+    delta_value = value2 - value1
+    p = ((time1, value1),
+         (time1 + delta_time / 3, value1 + delta_value / 3),
+         (time1 + delta_time * 2 / 3, value1 + delta_value * 2 / 3),
+         (time2, value2))
+    times = array('d', [time1])
+    values = array('d', [value1])
+    flatten(p, tolerance, written_level(level, truncate), resolution, times,
+            values)
+    return times[1:], truncated(values[1:], truncate)
+
+
+def concatenate(segments) -> tuple:
+    """Join a list of (times, values) pairs into a single pair of arrays."""
+    if np is not None:
+        if not segments:
+            return np.empty(0), np.empty(0)
+        return (np.concatenate([np.asarray(times, dtype=np.float64)
+                                for times, _ in segments]),
+                np.concatenate([np.asarray(values, dtype=np.float64)
+                                for _, values in segments]))
+
+    times = array('d')
+    values = array('d')
+    for segment_times, segment_values in segments:
+        times.extend(segment_times)
+        values.extend(segment_values)
+    return times, values
@@ -0,0 +1,205 @@
+import bisect
+import heapq
+from typing import Callable, Dict, List, Tuple
+
+from als_to_midi import MidiFile
+
+# A DIN MIDI link carries 31250 bits per second, in bytes of 10 bits.
+DIN_BYTES_PER_SECOND = 3125
+WINDOW = 0.1
+
+# The size on the wire of the channel messages, in bytes.
+NOTE_SIZE = 3
+AUTOMATION_SIZES = {MidiFile.CONTROLLER: 3, MidiFile.PITCH_WHEEL: 3,
+                    MidiFile.CHANNEL_PRESSURE: 2}
+
+
+def tempo_clock(midi: MidiFile.MIDIFile) -> Callable[[float], float]:
+    """Return a function converting a time in beats to seconds, following
+    the tempo events added to midi (120 BPM before the first one)."""
+    tempos = sorted((event.time, event.tempo) for track in midi.tracks
+                    for event in track.eventList
+                    if event.kind == MidiFile.TEMPO)
+    starts, offsets, periods = [0.0], [0.0], [0.5]
+    for time, tempo in tempos:
+        if time <= starts[-1]:
+            periods[-1] = tempo / 1e6
+            continue
+        offsets.append(offsets[-1] + (time - starts[-1]) * periods[-1])
+        starts.append(time)
+        periods.append(tempo / 1e6)
+
+    def clock(time: float) -> float:
+        i = max(bisect.bisect_right(starts, time) - 1, 0)
+        return offsets[i] + (time - starts[i]) * periods[i]
+
+    return clock
+
+
+def note_messages(track: MidiFile.MIDITrack) -> List[Tuple[float, int]]:
+    """Return the time in beats and the channel of the note on and note off
+    messages of a track, as they are written: without duplicates, and with
+    the note offs of overlapping notes moved."""
+    notes = MidiFile.MIDITrack(track.remdep, track.deinterleave)
+    notes.eventList = [event for event in track.eventList
+                       if event.kind == MidiFile.NOTE_ON]
+    notes.closeTrack()
+    return [(event.time / MidiFile.TICKSPERBEAT, event.channel)
+            for event in notes.MIDIEventList]
+
+
+def automation_value(event) -> float:
+    """The value of an automation event, pitch bends scaled to the range of
+    controllers."""
+    if event.kind == MidiFile.CONTROLLER:
+        return event.parameter
+    if event.kind == MidiFile.PITCH_WHEEL:
+        return event.pitch_wheel_value / 64
+    return event.vibrato_value
+
+
+def lane_label(track_name: str, event) -> str:
+    if event.kind == MidiFile.CONTROLLER:
+        target = f'CC {event.controller_number}'
+    elif event.kind == MidiFile.PITCH_WHEEL:
+        target = 'Pitch Bend'
+    else:
+        target = 'Channel Pressure'
+    return f'{track_name} / {target}'
+
+
+class Lane(object):
+    """The points of one automation lane, in time order, as a linked list
+    the points are dropped from."""
+    __slots__ = ('label', 'events', 'seconds', 'values', 'previous', 'next',
+                 'alive', 'dropped')
+
+    def __init__(self, label: str, events: list, seconds: List[float]):
+        self.label = label
+        self.events = events
+        self.seconds = seconds
+        self.values = [automation_value(event) for event in events]
+        self.previous = list(range(-1, len(events) - 1))
+        self.next = list(range(1, len(events) + 1))
+        self.next[-1] = -1
+        self.alive = [True] * len(events)
+        self.dropped = 0
+
+    def significance(self, i: int) -> float:
+        """How far point i is from the line joining its neighbours: what
+        dropping it changes. Only defined for intermediate points."""
+        p, n = self.previous[i], self.next[i]
+        seconds, values = self.seconds, self.values
+        if seconds[n] <= seconds[p]:
+            return abs(values[i] - values[p])
+        expected = values[p] + (values[n] - values[p]) * \
+            (seconds[i] - seconds[p]) / (seconds[n] - seconds[p])
+        return abs(values[i] - expected)
+
+    def intermediate(self, i: int) -> bool:
+        return self.alive[i] and self.previous[i] != -1 and self.next[i] != -1
+
+    def drop(self, i: int) -> Tuple[int, int]:
+        """Unlink point i, returning its neighbours."""
+        p, n = self.previous[i], self.next[i]
+        self.next[p] = n
+        self.previous[n] = p
+        self.alive[i] = False
+        self.dropped += 1
+        return p, n
+
+
+def budget_automation(midi: MidiFile.MIDIFile, bytes_per_second: float,
+                      per_channel: bool = False,
+                      window: float = WINDOW) -> Dict[str, Tuple[int, int]]:
+    """Drop automation events from midi, before it is closed, until the
+    channel messages of every window seconds fit in bytes_per_second.
+
+    The budget is shared by all the channels (a port), or applied to each
+    channel. Notes are always kept. In a window over budget, the
+    intermediate points of the controller, pitch bend and channel pressure
+    lanes are dropped, least significant first: the one whose value is the
+    closest to the line joining its neighbours. The first and last points
+    of a lane are kept. Prints, and returns, the number of events of each
+    lane before and after.
+    """
+    clock = tempo_clock(midi)
+    budget = bytes_per_second * window
+    # The bytes used in each window, and the lane points in it, by
+    # (window, channel) for a budget per channel or (window, 0).
+    used = {}
+    points = {}
+    lanes = []
+    for track in midi.tracks:
+        track_name = ''
+        by_lane = {}
+        for event in track.eventList:
+            kind = event.kind
+            if kind == MidiFile.TRACK_NAME:
+                track_name = event.trackName.decode('ISO-8859-1')
+            elif kind in AUTOMATION_SIZES:
+                lane_key = (event.channel, kind,
+                            getattr(event, 'controller_number', None))
+                by_lane.setdefault(lane_key, []).append(event)
+        for time, channel in note_messages(track):
+            key = (int(clock(time) / window), channel if per_channel else 0)
+            used[key] = used.get(key, 0) + NOTE_SIZE
+        for events in by_lane.values():
+            events.sort(key=lambda event: (event.time, event.insertion_order))
+            seconds = [clock(event.time) for event in events]
+            lane = Lane(lane_label(track_name, events[0]), events, seconds)
+            lane_id = len(lanes)
+            lanes.append(lane)
+            size = AUTOMATION_SIZES[events[0].kind]
+            group = events[0].channel if per_channel else 0
+            for i, second in enumerate(seconds):
+                key = (int(second / window), group)
+                used[key] = used.get(key, 0) + size
+                points.setdefault(key, []).append((lane_id, i))
+
+    over = 0
+    for key in sorted(used):
+        if used[key] <= budget:
+            continue
+        window_points = points.get(key, ())
+        members = set(window_points)
+        heap = [(lanes[lane_id].significance(i), lane_id, i)
+                for lane_id, i in window_points
+                if lanes[lane_id].intermediate(i)]
+        heapq.heapify(heap)
+        while used[key] > budget and heap:
+            significance, lane_id, i = heapq.heappop(heap)
+            lane = lanes[lane_id]
+            # Entries are left in the heap when a neighbour is dropped; only
+            # the one with the current significance is acted on.
+            if not lane.intermediate(i) or \
+                    lane.significance(i) != significance:
+                continue
+            for neighbour in lane.drop(i):
+                if (lane_id, neighbour) in members and \
+                        lane.intermediate(neighbour):
+                    heapq.heappush(heap, (lane.significance(neighbour),
+                                          lane_id, neighbour))
+            used[key] -= AUTOMATION_SIZES[lane.events[i].kind]
+        if used[key] > budget:
+            over += 1
+
+    dropped = set()
+    report = {}
+    for lane in lanes:
+        if lane.dropped:
+            dropped.update(id(event) for event, alive
+                           in zip(lane.events, lane.alive) if not alive)
+        before, after = report.get(lane.label, (0, 0))
+        report[lane.label] = (before + len(lane.events),
+                              after + len(lane.events) - lane.dropped)
+        print(f'{lane.label}: {len(lane.events)} -> '
+              f'{len(lane.events) - lane.dropped} events')
+    if dropped:
+        for track in midi.tracks:
+            track.eventList = [event for event in track.eventList
+                               if id(event) not in dropped]
+    if over:
+        print(f'{over} windows of {window} s still over budget, from notes '
+              f'or the ends of lanes')
+    return report
@@ -0,0 +1,155 @@
+import collections
+import contextlib
+import glob
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, List, Optional, Tuple
+
+from als_to_midi import midi_export
+
+
+def collect_inputs(patterns: Iterable[str]) -> List[str]:
+    """Expand directories (searched recursively) and glob patterns into a
+    sorted list of ALS files."""
+    als_files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                als_files.update(os.path.join(root, f) for f in files
+                                 if f.endswith('.als'))
+        else:
+            als_files.update(f for f in glob.glob(pattern, recursive=True)
+                             if os.path.isfile(f))
+    return sorted(als_files)
+
+
+def output_paths(als_files: List[str], output_dir: str) -> List[str]:
+    """Mirror the input files' layout below their common directory into
+    output_dir, replacing the extension with .mid."""
+    if not als_files:
+        return []
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(f))
+                               for f in als_files])
+    midi_files = []
+    for als_file in als_files:
+        relative = os.path.relpath(os.path.abspath(als_file), root)
+        midi_files.append(
+            os.path.join(output_dir, os.path.splitext(relative)[0] + '.mid'))
+    return midi_files
+
+
+def convert(als_file: str, midi_file: str, stream: bool = False,
+            cache: bool = False, incremental: bool = False,
+            thin: bool = False, tolerance: float = None,
+            tempo_resolution: float = None, tempo_threshold: float = None,
+            running_status: bool = False, budget: float = None,
+            budget_per_channel: bool = False) -> Tuple[str, int,
+                                                       Optional[str]]:
+    """Convert a single file with midi_export.main, returning its path, its
+    size and the error traceback if the conversion failed."""
+    size = 0
+    try:
+        size = os.path.getsize(als_file)
+        os.makedirs(os.path.dirname(midi_file) or '.', exist_ok=True)
+        # The per-file progress messages would interleave between workers.
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            midi_export.main(als_file, midi_file, stream=stream,
+                             cache=cache, incremental=incremental,
+                             thin=thin, tolerance=tolerance,
+                             tempo_resolution=tempo_resolution,
+                             tempo_threshold=tempo_threshold,
+                             running_status=running_status, budget=budget,
+                             budget_per_channel=budget_per_channel)
+    except Exception:
+        return als_file, size, traceback.format_exc()
+    return als_file, size, None
+
+
+def convert_alone(als_file: str, midi_file: str,
+                  options: tuple) -> Tuple[str, int, Optional[str]]:
+    """Convert a single file like convert, in a process of its own, so that
+    a conversion killing its worker only fails that file."""
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return executor.submit(convert, als_file, midi_file,
+                                   *options).result()
+        except BrokenProcessPool:
+            return als_file, 0, 'worker process died\n'
+
+
+def report(als_file: str, error: Optional[str]) -> bool:
+    """Print the outcome of a conversion; return whether it failed."""
+    if error is None:
+        print(f'done: {als_file}')
+        return False
+    print(f'FAILED: {als_file}\n{error}')
+    return True
+
+
+def batch_export(patterns: Iterable[str], output_dir: str,
+                 jobs: Optional[int] = None, stream: bool = False,
+                 cache: bool = False, incremental: bool = False,
+                 thin: bool = False, tolerance: float = None,
+                 tempo_resolution: float = None,
+                 tempo_threshold: float = None,
+                 running_status: bool = False, budget: float = None,
+                 budget_per_channel: bool = False) -> int:
+    """Convert every ALS file matched by patterns into output_dir on a pool
+    of jobs processes (one per CPU by default).
+
+    The other options are those of midi_export.main, applied to every file.
+
+    At most two conversions per worker are queued at any time. A failing
+    file is reported and does not stop the batch. A worker process dying
+    (e.g. killed when out of memory) takes the whole pool down with the
+    conversions it had queued: those are retried one at a time, each in a
+    process of its own, and the rest of the batch goes on in a new pool.
+    Returns the number of failed files.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    als_files = collect_inputs(patterns)
+    midi_files = output_paths(als_files, output_dir)
+    print(f'Batch export of {len(als_files)} files with {jobs} workers')
+    options = (stream, cache, incremental, thin, tolerance, tempo_resolution,
+               tempo_threshold, running_status, budget, budget_per_channel)
+
+    failed = 0
+    total_size = 0
+    start = time.perf_counter()
+    queue = collections.deque(zip(als_files, midi_files))
+    # The input and output of each conversion queued in the pool.
+    pending = {}
+    while True:
+        try:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                while queue or pending:
+                    while queue and len(pending) < 2 * jobs:
+                        future = executor.submit(convert, *queue[0], *options)
+                        pending[future] = queue.popleft()
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        als_file, size, error = future.result()
+                        del pending[future]
+                        total_size += size
+                        failed += report(als_file, error)
+        except BrokenProcessPool:
+            print(f'worker process died, retrying {len(pending)} files')
+            for als_file, midi_file in pending.values():
+                als_file, size, error = convert_alone(als_file, midi_file,
+                                                      options)
+                total_size += size
+                failed += report(als_file, error)
+            pending = {}
+            continue
+        break
+
+    elapsed = time.perf_counter() - start
+    count = len(als_files)
+    print(f'{count - failed}/{count} files converted in {elapsed:.2f} s '
+          f'({count / elapsed if elapsed else 0:.2f} files/s, '
+          f'{total_size / 1e6 / elapsed if elapsed else 0:.2f} MB/s)')
+    return failed
@@ -0,0 +1,135 @@
+import gc
+import hashlib
+import os
+import pickle
+import tempfile
+import warnings
+from typing import Optional
+
+from als_to_midi import models, profiling
+
+CACHE_DIR = os.environ.get(
+    'ALS_TO_MIDI_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'als_to_midi'))
+MAX_SIZE = 512 * 1024 * 1024
+SUFFIX = '.pickle'
+# Part of the key of every entry: bump it whenever the pickled models
+# change (their classes, attributes or __getstate__), so that the entries
+# of older versions are never loaded.
+CACHE_VERSION = 1
+
+
+def cache_key(file_path: str) -> str:
+    """Hash the compressed project together with the cache version."""
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@profiling.stage('cache.load',
+                 lambda args, result: 0 if result is None else 1, 'hits')
+def load(key: str, cache_dir: str = CACHE_DIR) -> Optional[models.LiveSet]:
+    path = os.path.join(cache_dir, key + SUFFIX)
+    # The collector would be triggered over and over by the many small
+    # objects being created, while unpickling can't create cycles of garbage.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, 'rb') as f:
+            live_set = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # A corrupt entry, or one pickled from classes that have changed
+        # since: parse again and drop it.
+        remove(path)
+        return None
+    finally:
+        if gc_enabled:
+            gc.enable()
+    # Entries are evicted by modification time, so a hit refreshes it.
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return live_set
+
+
+def remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def store(key: str, live_set: models.LiveSet, cache_dir: str = CACHE_DIR,
+          max_size: int = MAX_SIZE) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file first so that concurrent readers never see
+    # a partial entry.
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(live_set, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, os.path.join(cache_dir, key + SUFFIX))
+    except BaseException:
+        remove(tmp_path)
+        raise
+    evict(cache_dir, max_size)
+
+
+def evict(cache_dir: str = CACHE_DIR, max_size: int = MAX_SIZE) -> None:
+    """Remove the least recently used entries until the cache fits in
+    max_size bytes."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(SUFFIX):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def clear(cache_dir: str = CACHE_DIR) -> None:
+    if not os.path.isdir(cache_dir):
+        return
+    for name in os.listdir(cache_dir):
+        if name.endswith(SUFFIX):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                pass
+    print(f'cache cleared: {cache_dir}')
+
+
+def load_live_set(file_path: str, stream: bool = False,
+                  cache_dir: str = CACHE_DIR,
+                  max_size: int = MAX_SIZE) -> models.LiveSet:
+    """Return the parsed LiveSet of file_path, from the cache if the same
+    file has been parsed before."""
+    key = cache_key(file_path)
+    live_set = load(key, cache_dir)
+    if live_set is not None:
+        live_set.file_path = file_path
+        live_set.name = os.path.basename(file_path).replace('.als', '')
+        print("LiveSet", live_set.name, "loaded from cache")
+        return live_set
+    live_set = models.LiveSet(file_path, stream=stream)
+    try:
+        store(key, live_set, cache_dir, max_size)
+    except OSError as e:
+        # The cache only saves time: the export goes on without it.
+        warnings.warn(f'could not cache {file_path}: {e}', RuntimeWarning)
+    return live_set
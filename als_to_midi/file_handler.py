@@ -1,6 +1,12 @@
 import gzip
+from typing import Iterator
 
+from als_to_midi import profiling
 
+CHUNK_SIZE = 1 << 20
+
+
+@profiling.stage('file_handler.extract', lambda args, gz: len(gz), 'bytes')
 def extract(file_path: str, copy: bool) -> gzip.GzipFile:
     with gzip.open(file_path, 'rb') as f:
         gz = f.read()
@@ -15,6 +21,26 @@ def extract(file_path: str, copy: bool) -> gzip.GzipFile:
     return gz
 
 
+def iter_extract(file_path: str, copy: bool,
+                 chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the decompressed project in chunks of at most chunk_size bytes,
+    so that the whole XML never has to be held in memory at once."""
+    with gzip.open(file_path, 'rb') as f:
+        print(f'{file_path} opened')
+        copy_file = open(f'{file_path}.xml', 'wb+') if copy else None
+        try:
+            chunk = f.read(chunk_size)
+            while chunk:
+                if copy_file is not None:
+                    copy_file.write(chunk)
+                yield chunk
+                chunk = f.read(chunk_size)
+        finally:
+            if copy_file is not None:
+                copy_file.close()
+                print(f'copy written: {file_path}.xml')
+
+
 def compress(data, file_path: str) -> None:
     with gzip.open(file_path, 'wb+') as f:
         f.write(data)
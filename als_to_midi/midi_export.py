@@ -1,65 +1,437 @@
-from typing import List
+import bisect
+import hashlib
+import os
+import pickle
+from typing import Sequence, Tuple
 
-from als_to_midi import automation_curve, MidiFile, models
+from als_to_midi import automation_curve, bandwidth, MidiFile
+from als_to_midi import models, profiling
+from als_to_midi import cache as als_cache
 
+# The adaptive tolerance is in steps of a 7-bit controller; pitch bends
+# (14-bit) move by this much in such a step.
+PITCH_BEND_STEP = 128
+# Part of the keys of the tracks saved by an incremental export: bump it
+# whenever a change to the rendering or the encoding changes the MIDI data
+# written for the same input and options.
+STATE_VERSION = 3
+# The furthest, in seconds, that a beat of a tempo map rendered as steps may
+# drift from its time on the continuous tempo curve.
+MAX_TEMPO_DRIFT = 0.001
 
-def get_automation_events(events) -> List[dict]:
-    automation_events = []
+
+def affine_segment(previous_event, time, value, quantize, tolerance=None,
+                   level=int, truncate=True) -> tuple:
+    time1, value1 = previous_event.time, previous_event.value
+    # Only render the part of the ramp that starts at the beginning of the
+    # arrangement (the first event of an envelope sits far before it).
+    if time1 < 0:
+        value1 = value1 + (value - value1) * (0 - time1) / (time - time1)
+        time1 = 0
+    if time <= time1:
+        return [], []
+    if tolerance is not None:
+        times, values = automation_curve.adaptive_affine(
+            time1, value1, time, value, tolerance, level,
+            1 / MidiFile.TICKSPERBEAT, truncate)
+        # A ramp too steep to need fewer samples than the uniform sampling
+        # gets that instead.
+        if len(times) <= int((time - time1) / quantize):
+            return times, values
+    return automation_curve.affine(time1, value1, time, value, quantize,
+                                   truncate)
+
+
+def curve_segment(event, next_event, quantize, tolerance=None,
+                  level=int, truncate=True) -> tuple:
+    time1 = event.time if event.time >= 0 else 0
+    if tolerance is not None:
+        times, values = automation_curve.adaptive_b_curve(
+            time1, event.value, next_event.time, next_event.value,
+            event.cc_x, event.cc_y, tolerance, level,
+            1 / MidiFile.TICKSPERBEAT, truncate)
+        # As for ramps (see affine_segment).
+        if len(times) <= int((next_event.time - time1) / quantize):
+            return times, values
+    return automation_curve.b_curve(time1, event.value, next_event.time,
+                                    next_event.value, event.cc_x,
+                                    event.cc_y, quantize, truncate)
+
+
+@profiling.stage('get_automation_events',
+                 lambda args, result: len(result[0]), 'samples')
+def get_automation_events(events, tolerance: float = None, level=int,
+                          truncate: bool = True) -> Tuple[Sequence[float],
+                                                          Sequence[float]]:
+    """Render automation events into two parallel arrays holding the times
+    and the values of the samples.
+
+    By default ramps and curves are sampled every 1/64 beat and the values
+    are truncated, unless truncate is False. With a tolerance, they are
+    sampled adaptively instead, only where level(value) of the truncated
+    value, the value written to the MIDI file, moves by tolerance or more
+    (for a tolerance of 1, where it changes), but never more often than
+    every 1/64 beat on average over a segment. The values are truncated the
+    same way either way: only the density of the samples differs.
+    """
+    segments = []
     count = 0
     quantize = 1 / 64
     for event in events:
         event_time = event.time if event.time >= 0 else 0
         event_value = event.value
-        event_ccx = event.cc_x
-        event_ccy = event.cc_y
         if event.type == 'init' or event.type == 'break' or event.type == 'EndCurve':
-            automation_events.append({'Time': event_time, 'Value': event_value})
+            segments.append(([event_time], [event_value]))
 
         elif event.type == 'affine':
-            previous_event = events[count - 1]
-            points = automation_curve.affine(previous_event.time,
-                                             previous_event.value,
-                                             event_time,
-                                             event_value, quantize)
-            for p in points:
-                automation_events.append(
-                    {'Time': points[p]['Time'], 'Value': points[p]['Value']})
+            segments.append(affine_segment(events[count - 1], event_time,
+                                           event_value, quantize, tolerance,
+                                           level, truncate))
 
         elif event.type == 'bCurve':
-            next_event = events[count + 1]
-            points = automation_curve.b_curve(event_time, event_value,
-                                              next_event.time,
-                                              next_event.value,
-                                              event_ccx, event_ccy, quantize)
-            for p in points:
-                automation_events.append(
-                    {'Time': points[p]['Time'], 'Value': points[p]['Value']})
+            segments.append(curve_segment(event, events[count + 1], quantize,
+                                          tolerance, level, truncate))
 
         elif event.type == 'affine & bCurve':
-            previous_event = events[count - 1]
-            points = automation_curve.affine(previous_event.time,
-                                             previous_event.value,
-                                             event_time,
-                                             event_value, quantize)
-            for p in points:
-                automation_events.append(
-                    {'Time': points[p]['Time'], 'Value': points[p]['Value']})
-            next_event = events[count + 1]
-            points = automation_curve.b_curve(event_time, event_value,
-                                              next_event.time,
-                                              next_event.value,
-                                              event_ccx, event_ccy, quantize)
-            for p in points:
-                automation_events.append(
-                    {'Time': points[p]['Time'], 'Value': points[p]['Value']})
+            segments.append(affine_segment(events[count - 1], event_time,
+                                           event_value, quantize, tolerance,
+                                           level, truncate))
+            segments.append(curve_segment(event, events[count + 1], quantize,
+                                          tolerance, level, truncate))
 
         count += 1
 
-    return automation_events
+    return automation_curve.concatenate(segments)
+
+
+def volume_level(value: float) -> int:
+    # Scale value [0, 1] to [0, 100] and [1, 2] and [100, 127]
+    if value <= 1:
+        return int(value * 100)
+    return int(100 + value * 28 / 2)
+
+
+def pan_level(value: float) -> int:
+    # Scale value [-1, 1] to [0, 127]
+    return int((value + 1) * 64)
+
+
+def thin_samples(times: Sequence[float], values: Sequence[float],
+                 label: str, quantize=None) -> Tuple[list, list]:
+    """Drop the samples of an automation lane whose quantized value is the
+    one of the previous sample, which leaves what is played unchanged.
+
+    quantize maps a value to what is written in the MIDI file, the value
+    itself by default. Prints the number of events before and after, under
+    label.
+    """
+    kept_times = []
+    kept_values = []
+    previous = None
+    for time, value in zip(times, values):
+        level = value if quantize is None else quantize(value)
+        if level != previous:
+            kept_times.append(time)
+            kept_values.append(value)
+            previous = level
+    print(f'{label}: {len(values)} -> {len(kept_values)} events')
+    return kept_times, kept_values
+
+
+def render_tempo_map(tempo_map, resolution: float = None,
+                     threshold: float = None,
+                     max_drift: float = MAX_TEMPO_DRIFT) -> Tuple[list, list]:
+    """Render the tempo map as steps of constant tempo. A step ends after
+    resolution beats, or where the tempo moves more than threshold
+    microseconds per quarter note away from the tempo at its start.
+
+    Each step gets the tempo that makes it last as long as the continuous
+    curve does (sampled every 1/64 beat, unrounded), so the beat to seconds
+    drift is brought back under a microsecond at the start of every step.
+    Steps start on whole ticks, and are cut short where a longer one would
+    drift more than max_drift seconds at one of its samples. Steps keeping
+    the tempo of the previous one are merged. Prints the number of events and the largest drift
+    within the steps.
+
+    Returns the start times of the steps and their tempos in beats per
+    minute.
+    """
+    times, values = get_automation_events(tempo_map, truncate=False)
+    times, values = times.tolist(), values.tolist()
+    if not times:
+        return [], []
+    # The time of each sample in seconds, integrating the seconds per beat
+    # of the curve with the trapezoidal rule.
+    periods = [60 / value for value in values]
+    seconds = [0.0]
+    for k in range(1, len(times)):
+        seconds.append(seconds[-1] + (times[k] - times[k - 1]) *
+                       (periods[k] + periods[k - 1]) / 2)
+
+    step_times = []
+    tempos = []
+    drift = 0.0
+    # MIDIFile writes times in whole ticks: the steps start on them, so that
+    # their tempo events are written where they were rendered.
+    ticks = MidiFile.TICKSPERBEAT
+    start = round(times[0] * ticks) / ticks
+    # The first sample after the start of the step, and the rendered time of
+    # the start in seconds.
+    first = 1
+    elapsed = 0.0
+    while first < len(times):
+        # The sample ending the step after resolution beats or where the
+        # tempo moves more than threshold, or the last one.
+        last = first
+        while last < len(times) - 1 and not (
+                resolution is not None and times[last] - start >= resolution
+                or threshold is not None and
+                abs(60000000 / values[last] - 60000000 / values[first - 1]) >
+                threshold):
+            last += 1
+        # Each sample bounds the tempos, in seconds per beat, that keep it
+        # within max_drift of the curve: the step ends on the tick of the
+        # last sample whose own tempo is within the bounds of the samples
+        # before that tick.
+        low, high = 0.0, float('inf')
+        bounded = first
+        step_end = None
+        for k in range(first, len(times)):
+            end = round(times[k] * ticks) / ticks
+            if end <= start:
+                continue
+            while bounded < len(times) and times[bounded] < end:
+                offset = times[bounded] - start
+                if offset > 0:
+                    low = max(low, (seconds[bounded] - elapsed - max_drift) /
+                              offset)
+                    high = min(high, (seconds[bounded] - elapsed +
+                                      max_drift) / offset)
+                bounded += 1
+            if step_end is not None and (k > last or low > high):
+                break
+            # In microseconds per quarter note, as written in the MIDI file.
+            sample_tempo = round((seconds[k] + (end - times[k]) * periods[k] -
+                                  elapsed) / (end - start) * 1e6)
+            sample_tempo = min(max(sample_tempo, 1), 0xFFFFFF)
+            if step_end is None or low <= sample_tempo / 1e6 <= high:
+                step_end, tempo = end, sample_tempo
+        if step_end is None:
+            break
+        first = bisect.bisect_right(times, step_end, first)
+        for k in range(bisect.bisect_right(times, start), first):
+            drift = max(drift, abs(elapsed + tempo * (times[k] - start) / 1e6
+                                   - seconds[k]))
+        if not tempos or tempo != tempos[-1]:
+            step_times.append(start)
+            tempos.append(tempo)
+        elapsed += tempo * (step_end - start) / 1e6
+        start = step_end
+    # The tempo of the last sample holds after it.
+    tempo = round(periods[-1] * 1e6)
+    if not tempos or tempo != tempos[-1]:
+        step_times.append(start)
+        tempos.append(tempo)
+
+    print(f'Tempo: {len(times)} -> {len(tempos)} events, '
+          f'drift {drift * 1000:.3f} ms')
+    # MIDIFile truncates 60000000 / bpm, so aim at the middle of the
+    # microsecond.
+    return step_times, [60000000 / (tempo + 0.5) for tempo in tempos]
+
+
+def add_tempo_map(my_midi: MidiFile.MIDIFile,
+                  live_set: models.LiveSet, thin: bool = False,
+                  tolerance: float = None, tempo_resolution: float = None,
+                  tempo_threshold: float = None) -> None:
+    if tempo_resolution is not None or tempo_threshold is not None:
+        times, values = render_tempo_map(live_set.tempo_map,
+                                         tempo_resolution, tempo_threshold)
+        for time, value in zip(times, values):
+            my_midi.addTempo(0, time, value)
+        return
+    times, values = get_automation_events(live_set.tempo_map, tolerance)
+    times, values = times.tolist(), values.tolist()
+    if thin:
+        # The tempo is written in whole microseconds per quarter note.
+        times, values = thin_samples(times, values, 'Tempo',
+                                     lambda value: int(60000000 / value))
+    for time, value in zip(times, values):
+        my_midi.addTempo(0, time, value)
+
+
+def add_track(my_midi: MidiFile.MIDIFile, track: models.MidiTrack,
+              track_id: int, channel: int, thin: bool = False,
+              tolerance: float = None) -> None:
+    """Add the notes and automation of a track.
+
+    With thin, the automation samples that repeat the previous value of
+    their lane are dropped (see thin_samples). With a tolerance, the
+    automation is sampled adaptively (see get_automation_events).
+    """
+    time = 0
+
+    # Add track name.
+    name = str(track.name)
+    my_midi.addTrackName(track_id, time, name)
+
+    # Add Notes.
+    notes = track.notes
+    my_midi.addNotes(track_id, channel, notes.pitch, notes.start,
+                     notes.duration, notes.velocity)
+
+    # Add Clip Automations to MidiTrack
+    for clip in track.arrangement_clips:
+        for envelope in clip.envelopes:
+            target = envelope.target_name
+            lane_tolerance = tolerance
+            if tolerance is not None and target == 'Pitch Bend':
+                lane_tolerance = tolerance * PITCH_BEND_STEP
+            times, values = get_automation_events(envelope.events,
+                                                  lane_tolerance)
+            times, values = times.tolist(), values.tolist()
+            if thin:
+                times, values = thin_samples(
+                    times, values, f'{name} / {clip.name} / {target}', int)
+            for time, value in zip(times, values):
+                time = time + clip.start_time - clip.loop_start
+                value = int(value)
+                # print('time:{}, value:{}'.format(time, value))
+
+                if target == 'Pitch Bend':
+                    my_midi.addPitchWheelEvent(track_id, channel,
+                                               time,
+                                               value)
+                    print(time, value)
+                elif target == 'Channel Pressure':
+                    my_midi.addChannelPressureEvent(track_id,
+                                                    channel,
+                                                    time, value)
+
+                # Prevent CC7(Volume) and CC10(Pan) Conflicts
+                elif int(target) != 7 and int(target) != 10:
+                    my_midi.addControllerEvent(track_id, channel,
+                                               time,
+                                               int(target), value)
+
+                if isinstance(target, int) and int(
+                        target) == 7 and not track.volume_midi_export:
+                    my_midi.addControllerEvent(track_id, channel,
+                                               time,
+                                               int(target), value)
+
+                if isinstance(target, int) and int(
+                        target) == 10 and not track.pan_midi_export:
+                    my_midi.addControllerEvent(track_id, channel,
+                                               time,
+                                               int(target), value)
+
+    # Add Volume Automation to Track
+    if track.volume_midi_export:
+        times, values = get_automation_events(
+            track.volume_automation_events, tolerance, volume_level)
+        times, values = times.tolist(), values.tolist()
+        if thin:
+            times, values = thin_samples(times, values, f'{name} / Volume',
+                                         volume_level)
+        for time, value in zip(times, values):
+            # print('time:', time, 'value:', value)
+            my_midi.addControllerEvent(track_id, channel, time, 7,
+                                       volume_level(value))
+
+    # Add Pan Automation to Track
+    if track.pan_midi_export:
+        times, values = get_automation_events(
+            track.pan_automation_events, tolerance, pan_level)
+        times, values = times.tolist(), values.tolist()
+        if thin:
+            times, values = thin_samples(times, values, f'{name} / Pan',
+                                         pan_level)
+        for time, value in zip(times, values):
+            my_midi.addControllerEvent(track_id, channel, time, 10,
+                                       pan_level(value))
+
+
+def track_key(track: models.MidiTrack, track_id: int, channel: int,
+              thin: bool = False, tolerance: float = None,
+              running_status: bool = False) -> str:
+    """Fingerprint everything the encoded MIDI track of a MidiTrack depends
+    on."""
+    return hashlib.sha256(repr((
+        track.fingerprint, track_id, channel, track.midi_export,
+        track.volume_midi_export, track.pan_midi_export, thin, tolerance,
+        running_status, STATE_VERSION)).encode()).hexdigest()
+
+
+def tempo_key(live_set: models.LiveSet, thin: bool = False,
+              tolerance: float = None, tempo_resolution: float = None,
+              tempo_threshold: float = None,
+              running_status: bool = False) -> str:
+    return hashlib.sha256(repr((
+        [(e.time, e.value, e.cc_x, e.cc_y, e.type)
+         for e in live_set.tempo_map], thin, tolerance, tempo_resolution,
+        tempo_threshold, running_status, STATE_VERSION)).encode()).hexdigest()
+
+
+def load_state(state_path: str) -> dict:
+    try:
+        with open(state_path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return {}
+
+
+def reusable(state: dict, keys: list, index: int) -> bool:
+    """Whether the encoded MIDI track at index in the previous export's
+    state can be reused."""
+    return index < len(state.get('keys', ())) and keys[index] is not None \
+        and state['keys'][index] == keys[index]
 
 
 def midi_export(live_set: models.LiveSet, midi_file_path: str,
-                separate_channels: bool = False) -> None:
+                separate_channels: bool = False,
+                incremental: bool = False, jobs: int = None,
+                thin: bool = False, tolerance: float = None,
+                tempo_resolution: float = None,
+                tempo_threshold: float = None,
+                running_status: bool = False, budget: float = None,
+                budget_per_channel: bool = False) -> None:
+    """Export the LiveSet to a MIDI file.
+
+    With jobs greater than one, the MIDI tracks are encoded on a pool of
+    that many processes.
+
+    With thin, the automation samples that don't change the value of their
+    lane are left out, and the number of events kept for each lane is
+    reported. The values played are unchanged, but since delta times carry
+    their rounding error over to the next event, the events kept may move
+    by one tick.
+
+    With a tolerance, ramps and curves are sampled only where the MIDI value
+    they are written as moves by tolerance or more, instead of every 1/64
+    beat, and never more densely. The tolerance is in steps of a 7-bit
+    controller, scaled by PITCH_BEND_STEP for pitch bends; a tolerance of 1
+    renders every change of value of the controllers.
+
+    With a tempo_resolution (in beats) or a tempo_threshold (in microseconds
+    per quarter note), the tempo map is written as steps of those lengths
+    or between those changes instead (see render_tempo_map), split where
+    the rendered beat times would drift more than MAX_TEMPO_DRIFT seconds,
+    and the largest drift is reported.
+
+    With running_status, the status byte of channel events is left out
+    where it repeats the previous one, and note offs are written as note ons
+    of velocity 0 so that they share the status of the note ons.
+
+    With a budget, in bytes per second, automation events are dropped until
+    the messages of the file, or of each of its channels with
+    budget_per_channel, fit in it (see bandwidth.budget_automation).
+
+    In incremental mode the encoded MIDI tracks are saved next to the
+    output, in midi_file_path + '.state', and are reused by the next
+    incremental export for the tracks that haven't changed. The output isn't
+    written at all if nothing changed.
+    """
     print('Init Midi Export')
     # How Many Midi Tracks in liveSet?
     used_midi_track = 0
@@ -68,9 +440,37 @@ def midi_export(live_set: models.LiveSet, midi_file_path: str,
             used_midi_track += 1
     # print ("Used Midi Track count:", used_midi_track)
 
+    # The key of each MIDI track; the tempo track comes first.
+    keys = [None] * (len(live_set.tracks) + 1)
+    if incremental:
+        keys[0] = tempo_key(live_set, thin, tolerance, tempo_resolution,
+                            tempo_threshold, running_status)
+        i = 0
+        for track in live_set.tracks:
+            if track.midi_export:
+                channel = i % 16 if separate_channels else 0
+                keys[i + 1] = track_key(track, i, channel, thin,
+                                        tolerance, running_status)
+                i += 1
+        if budget is not None:
+            # The budget is shared by the tracks, so that one can only be
+            # reused if none of them changed.
+            combined = hashlib.sha256(repr((
+                keys, budget, budget_per_channel)).encode()).hexdigest()
+            keys = [combined if key is not None else None for key in keys]
+
+    state_path = f'{midi_file_path}.state'
+    state = load_state(state_path) if incremental else {}
+    if state.get('keys') == keys and os.path.exists(midi_file_path):
+        print('Midi Export unchanged, skipped')
+        return
+    reused = 0
+
     # Create the MIDIFile Object with 1 track
     my_midi = MidiFile.MIDIFile(len(live_set.tracks), file_format=1,
-                                adjust_origin=True)
+                                adjust_origin=True,
+                                running_status=running_status,
+                                note_off_as_note_on=running_status)
 
     i = 0
     for track in live_set.tracks:
@@ -78,101 +478,71 @@ def midi_export(live_set: models.LiveSet, midi_file_path: str,
         if track.midi_export:  # len(track.notes) != 0 and
             track_id = i
             channel = i % 16 if separate_channels else 0
-            time = 0
-
-            # Add track name.
-            name = str(track.name)
-            my_midi.addTrackName(track_id, time, name)
+            i += 1
 
             # Add tempo Map to first track.
             if track_id == 0:
-                events = get_automation_events(live_set.tempo_map)
-                for event in events:
-                    my_midi.addTempo(track_id, event['Time'], event['Value'])
-
-            # Add Notes.
-            for note in track.notes:
-                pitch = note.pitch
-                time = note.start
-                duration = note.duration
-                volume = note.velocity
-
-                my_midi.addNote(track_id, channel, pitch, time, duration,
-                                volume)
-
-            # Add Clip Automations to MidiTrack
-            for clip in track.arrangement_clips:
-                for envelope in clip.envelopes:
-                    events = get_automation_events(envelope.events)
-                    target = envelope.target_name
-                    for event in events:
-                        time = event['Time'] + clip.start_time - clip.loop_start
-                        value = int(event['Value'])
-                        # print('time:{}, value:{}'.format(time, value))
-
-                        if target == 'Pitch Bend':
-                            my_midi.addPitchWheelEvent(track_id, channel,
-                                                       time,
-                                                       value)
-                            print(time, value)
-                        elif target == 'Channel Pressure':
-                            my_midi.addChannelPressureEvent(track_id,
-                                                            channel,
-                                                            time, value)
-
-                        # Prevent CC7(Volume) and CC10(Pan) Conflicts
-                        elif int(target) != 7 and int(target) != 10:
-                            my_midi.addControllerEvent(track_id, channel,
-                                                       time,
-                                                       int(target), value)
-
-                        if isinstance(target, int) and int(
-                                target) == 7 and not track.volume_midi_export:
-                            my_midi.addControllerEvent(track_id, channel,
-                                                       time,
-                                                       int(target), value)
-
-                        if isinstance(target, int) and int(
-                                target) == 10 and not track.pan_midi_export:
-                            my_midi.addControllerEvent(track_id, channel,
-                                                       time,
-                                                       int(target), value)
+                if reusable(state, keys, 0):
+                    my_midi.tracks[0].reuseEncoded(*state['tracks'][0])
+                    reused += 1
+                else:
+                    add_tempo_map(my_midi, live_set, thin, tolerance,
+                                  tempo_resolution, tempo_threshold)
 
-            i += 1
+            if reusable(state, keys, track_id + 1):
+                my_midi.tracks[track_id + 1].reuseEncoded(
+                    *state['tracks'][track_id + 1])
+                reused += 1
+            else:
+                add_track(my_midi, track, track_id, channel, thin,
+                          tolerance)
 
-            # Add Volume Automation to Track
-            if track.volume_midi_export:
-                events = get_automation_events(track.volume_automation_events)
-                for event in events:
-                    time = event['Time']
-                    value = event['Value']
-
-                    # Scale value [0, 1] to [0, 100] and [1, 2] and [100, 127]
-                    if value <= 1:
-                        value = int(value * 100)
-                    else:
-                        value = int(100 + value * 28 / 2)
-                    # print('time:', time, 'value:', value)
-                    my_midi.addControllerEvent(track_id, channel, time, 7,
-                                               value)
+    if budget is not None and not reused:
+        bandwidth.budget_automation(my_midi, budget, budget_per_channel)
 
-            # Add Pan Automation to Track
-            if track.pan_midi_export:
-                events = get_automation_events(track.pan_automation_events)
-                for event in events:
-                    time = event['Time']
-                    value = event['Value']
-                    # Scale value [-1, 1] to [0, 127]
-                    value = int((value + 1) * 64)
-                    my_midi.addControllerEvent(track_id, channel, time, 10,
-                                               value)
+    # Unless they are encoded in parallel or kept for the next incremental
+    # export, the tracks are encoded as they are written, one at a time.
+    if incremental or (jobs is not None and jobs > 1):
+        my_midi.close(jobs=jobs)
+    if reused and my_midi.origin != state['origin']:
+        # The reused tracks were shifted to another origin.
+        print('Midi Export origin changed, exporting all tracks')
+        os.remove(state_path)
+        midi_export(live_set, midi_file_path, separate_channels,
+                    incremental=incremental, jobs=jobs, thin=thin,
+                    tolerance=tolerance, tempo_resolution=tempo_resolution,
+                    tempo_threshold=tempo_threshold,
+                    running_status=running_status, budget=budget,
+                    budget_per_channel=budget_per_channel)
+        return
+    if incremental:
+        print(f'{reused}/{len(keys)} Midi Tracks reused')
 
     # And write it to disk.
     with open(midi_file_path, 'wb+') as bin_file:
-        my_midi.writeFile(bin_file)
+        my_midi.writeFile(bin_file, stream=True)
+
+    if incremental:
+        state = {'keys': keys, 'origin': my_midi.origin,
+                 'tracks': [(t.MIDIdata, t.firstTime) for t in my_midi.tracks]}
+        with open(state_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
     print('Midi Export Done')
 
 
-def main(als_file: str, midi_file: str):
-    live_set = models.LiveSet(als_file)
-    midi_export(live_set, midi_file, separate_channels=True)
+def main(als_file: str, midi_file: str, stream: bool = False,
+         cache: bool = False, incremental: bool = False, jobs: int = None,
+         thin: bool = False, tolerance: float = None,
+         tempo_resolution: float = None, tempo_threshold: float = None,
+         running_status: bool = False, budget: float = None,
+         budget_per_channel: bool = False):
+    if cache:
+        live_set = als_cache.load_live_set(als_file, stream=stream)
+    else:
+        live_set = models.LiveSet(als_file, stream=stream)
+    midi_export(live_set, midi_file, separate_channels=True,
+                incremental=incremental, jobs=jobs, thin=thin,
+                tolerance=tolerance, tempo_resolution=tempo_resolution,
+                tempo_threshold=tempo_threshold,
+                running_status=running_status, budget=budget,
+                budget_per_channel=budget_per_channel)
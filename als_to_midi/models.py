@@ -1,12 +1,24 @@
+import copy
+import hashlib
+import itertools
 import os
+from array import array
+from collections.abc import Sequence
 from typing import List
 
 from lxml import etree as et
 
-from als_to_midi import file_handler
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from als_to_midi import file_handler, profiling
 
 
 class Envelope:
+    __slots__ = ('target_id', 'target_name', 'events')
+
     def __init__(self, target_id=None, target_name=None, events=None):
         self.target_id = target_id
         self.target_name = target_name
@@ -18,6 +30,8 @@ class Envelope:
 
 
 class Event:
+    __slots__ = ('time', 'value', 'cc_x', 'cc_y', 'type')
+
     def __init__(self, time, value, cc_x, cc_y, previous_event=None):
         self.time = time
         self.value = value
@@ -44,16 +58,18 @@ class Event:
         elif previous_event is not None and previous_event.time == self.time:
             self.type = 'break'
         elif previous_event is not None and previous_event.time != self.time and previous_event.value != self.value and self.cc_x is None \
-                and self.cc_y is None and previous_event.ccX is None and previous_event.ccY is None:
+                and self.cc_y is None and previous_event.cc_x is None and previous_event.cc_y is None:
             self.type = 'affine'
         elif previous_event is not None and previous_event.time != self.time and self.cc_x is None and self.cc_y is None \
-                and previous_event.ccX is not None and previous_event.ccY is not None and self.type is None:
+                and previous_event.cc_x is not None and previous_event.cc_y is not None and self.type is None:
             self.type = 'EndCurve'
         elif previous_event is None:
             self.type = 'init'
 
 
 class Note:
+    __slots__ = ('pitch', 'start', 'duration', 'velocity', 'is_enable')
+
     def __init__(self, pitch, time, duration, velocity, is_enable):
         self.pitch = int(pitch)
         self.start = float(time)
@@ -69,6 +85,180 @@ class Note:
                f'isEnable: {str(self.is_enable)}'
 
 
+class NoteColumns:
+    """Notes stored as parallel arrays, one per attribute.
+
+    Behaves like a list of Note objects (len, indexing, iteration, append),
+    creating the Note objects only when they are asked for. The columns
+    themselves can be handed over in bulk, e.g. to MIDIFile.addNotes.
+    """
+
+    def __init__(self):
+        self.pitch = array('B')
+        self.start = array('d')
+        self.duration = array('d')
+        self.velocity = array('B')
+        self.enabled = array('B')
+
+    def __len__(self):
+        return len(self.pitch)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return Note(self.pitch[index], self.start[index],
+                    self.duration[index], self.velocity[index],
+                    'true' if self.enabled[index] else 'false')
+
+    def __iter__(self):
+        for pitch, start, duration, velocity, enabled in zip(
+                self.pitch, self.start, self.duration, self.velocity,
+                self.enabled):
+            yield Note(pitch, start, duration, velocity,
+                       'true' if enabled else 'false')
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def add(self, pitch, start, duration, velocity, enabled) -> None:
+        self.pitch.append(pitch)
+        self.start.append(start)
+        self.duration.append(duration)
+        self.velocity.append(velocity)
+        self.enabled.append(enabled)
+
+    def append(self, note: Note) -> None:
+        self.add(note.pitch, note.start, note.duration, note.velocity,
+                 note.is_enable != 'false')
+
+    def extend(self, pitch, start, duration, velocity, enabled) -> None:
+        columns = (self.pitch, self.start, self.duration, self.velocity,
+                   self.enabled)
+        for column, values in zip(columns,
+                                  (pitch, start, duration, velocity, enabled)):
+            if np is not None and isinstance(values, np.ndarray):
+                # Copied as a block rather than element by element.
+                column.frombytes(values.astype(column.typecode).tobytes())
+            else:
+                column.extend(values)
+
+
+def loop_starts(start: float, loop_length: float, end: float) -> List[float]:
+    """Return the start times of a note placed at start and repeated every
+    loop_length beats until end.
+
+    The times are accumulated like repeated additions would, so they round
+    to exactly the same ticks.
+    """
+    if start >= end:
+        return []
+    if loop_length <= 0:
+        return [start]
+    count = int((end - start) / loop_length) + 2
+    starts = list(itertools.accumulate(itertools.chain(
+        (start,), itertools.repeat(loop_length, count))))
+    while starts[-1] >= end:
+        starts.pop()
+    return starts
+
+
+def expand_clip_notes(midi_clip):
+    """Place the notes of a clip in the arrangement, repeating them when
+    the clip loops.
+
+    Returns the pitch, start, duration, velocity and enabled columns of the
+    placed notes, in the order the clip's notes and their repetitions come.
+    """
+    if np is not None and len(midi_clip.notes):
+        return expand_clip_notes_vectorized(midi_clip)
+    current_start = midi_clip.start
+    current_end = midi_clip.end
+    loop_start = midi_clip.loop_start
+    loop_end = midi_clip.loop_end
+    start_relative = midi_clip.start_relative
+    length = current_end - current_start
+    loop_length = loop_end - loop_start
+    loop = midi_clip.loop
+    looping = loop and length > loop_length - start_relative
+    notes = midi_clip.notes
+    columns = ([], [], [], [], [])
+    for pitch, note_start, duration, velocity, enabled in zip(
+            notes.pitch, notes.start, notes.duration, notes.velocity,
+            notes.enabled):
+        start = current_start + note_start - loop_start - start_relative
+        if current_start <= start < current_end:
+            starts = [start]
+            # The loop test is made on the start in the arrangement.
+            if looping and loop_start <= start < loop_end:
+                starts += loop_starts(start, loop_length, current_end)
+        # case loop Note after start marker
+        elif loop and loop_start <= note_start < loop_end:
+            starts = loop_starts(start, loop_length, current_end)[1:]
+        else:
+            continue
+        count = len(starts)
+        columns[0].extend(itertools.repeat(pitch, count))
+        columns[1].extend(starts)
+        columns[2].extend(itertools.repeat(duration, count))
+        columns[3].extend(itertools.repeat(velocity, count))
+        columns[4].extend(itertools.repeat(enabled, count))
+    return columns
+
+
+def expand_clip_notes_vectorized(midi_clip):
+    """numpy version of expand_clip_notes.
+
+    Each note gets a row holding its start followed by all its repetitions,
+    accumulated along the row, and a mask selects the emitted cells.
+    """
+    current_start = midi_clip.start
+    current_end = midi_clip.end
+    loop_start = midi_clip.loop_start
+    loop_end = midi_clip.loop_end
+    start_relative = midi_clip.start_relative
+    length = current_end - current_start
+    loop_length = loop_end - loop_start
+    loop = midi_clip.loop
+    notes = midi_clip.notes
+    note_starts = np.frombuffer(notes.start, dtype=np.float64)
+    starts = current_start + note_starts - loop_start - start_relative
+
+    placed = (current_start <= starts) & (starts < current_end)
+    repeated = np.zeros(len(starts), dtype=bool)
+    after_marker = np.zeros(len(starts), dtype=bool)
+    if loop and loop_length > 0:
+        # The loop test is made on the start in the arrangement.
+        if length > loop_length - start_relative:
+            repeated = placed & (loop_start <= starts) & (starts < loop_end)
+        after_marker = ~placed & (loop_start <= note_starts) & \
+            (note_starts < loop_end)
+    looped = repeated | after_marker
+
+    count = 1
+    if looped.any():
+        # The looped notes can all start after the end of the clip (with a
+        # negative StartRelative), leaving no repetition to emit.
+        count = max(count, int(
+            (current_end - starts[looped].min()) / loop_length) + 3)
+    # Column 0 is the note itself, columns 1.. its accumulated repetitions
+    # starting from the note again.
+    grid = np.empty((len(starts), count + 1))
+    grid[:, 0] = starts
+    grid[:, 1] = starts
+    grid[:, 2:] = loop_length
+    grid[:, 1:] = np.cumsum(grid[:, 1:], axis=1)
+    emitted = (grid < current_end) & looped[:, None]
+    emitted[:, 0] = placed
+    emitted[:, 1] &= repeated
+
+    rows = np.nonzero(emitted)[0]
+    pitch, duration, velocity, enabled = (
+        np.frombuffer(column, dtype=column.typecode)[rows]
+        for column in (notes.pitch, notes.duration, notes.velocity,
+                       notes.enabled))
+    return pitch, grid[emitted], duration, velocity, enabled
+
+
 class MidiClip:
     def __init__(self, track, xml_clip):
         self.xml_clip = xml_clip
@@ -93,29 +283,29 @@ class MidiClip:
         self.envelopes = self.parse_envelopes(xml_clip)
         # print (self.envelopes)
 
+    def __getstate__(self):
+        # lxml elements can't be pickled, and aren't needed once parsed.
+        state = self.__dict__.copy()
+        state['xml_clip'] = None
+        return state
+
     def __repr__(self):
         return f"Clip Name: {self.name}\n" \
                f"Start Time: {self.start_time}\n" \
                f"{self.notes}"
 
     def parse_notes(self, xml_clip):
-        clip_notes = []
+        clip_notes = NoteColumns()
         pitches = xml_clip.findall('Notes/KeyTracks/KeyTrack')
         for p in pitches:
-            pitch = p.find('MidiKey').get('Value')
+            pitch = int(p.find('MidiKey').get('Value'))
             notes = p.findall('Notes/MidiNoteEvent')
             for n in notes:
-                time = n.get("Time")
-                duration = n.get("Duration")
-                velocity = n.get("Velocity")
-                is_enable = n.get("IsEnabled")
-                note = Note(pitch, time, duration, velocity,
-                            is_enable)
-                clip_notes.append(note)
-        '''
-        for note in clip_notes:
-            print note
-        '''
+                time = float(n.get("Time"))
+                duration = float(n.get("Duration"))
+                velocity = int(float(n.get("Velocity")))
+                is_enable = n.get("IsEnabled") != 'false'
+                clip_notes.add(pitch, time, duration, velocity, is_enable)
         return clip_notes
 
     def parse_envelopes(self, xml_clip):
@@ -171,8 +361,11 @@ def get_automation_events(xml_path_parameter):
 
 
 class MidiTrack:
+    @profiling.stage('MidiTrack.__init__',
+                     lambda args, result: len(args[0].notes), 'notes')
     def __init__(self, xml_track):
         self.xml_track = xml_track
+        self._fingerprint = None
         self.name = str(xml_track.find('Name/EffectiveName').get('Value'))
         self.id = int(xml_track.get('Id'))
         self.color_index = int(xml_track.find('ColorIndex').get('Value'))
@@ -199,10 +392,34 @@ class MidiTrack:
         self.pan_automation_events = get_automation_events(
             xml_track.find('DeviceChain/Mixer/Pan'))  # PanPath
 
+    def __getstate__(self):
+        # lxml elements can't be pickled, and aren't needed once parsed.
+        state = self.__dict__.copy()
+        state['xml_track'] = None
+        state['_fingerprint'] = self.fingerprint
+        return state
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the track's XML, telling apart changed tracks between two
+        versions of a set."""
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.sha256(
+                et.tostring(self.xml_track)).hexdigest()
+        return self._fingerprint
+
     def __repr__(self):
         return "MidiTrack Name: {}\n{}\n".format(self.name,
                                                  self.arrangement_clips)
 
+    def release_xml(self):
+        """Drop the references to the source XML once everything has been
+        parsed from it."""
+        self._fingerprint = self.fingerprint
+        self.xml_track = None
+        for clip in self.arrangement_clips:
+            clip.xml_clip = None
+
     def parse_clips(self):
         midi_clips = []
         for midi_clip in self.xml_track.findall(
@@ -212,42 +429,9 @@ class MidiTrack:
         return midi_clips
 
     def parse_notes(self):
-        midi_notes = []
+        midi_notes = NoteColumns()
         for midi_clip in self.arrangement_clips:
-            current_start = midi_clip.start
-            current_end = midi_clip.end
-            loop_start = midi_clip.loop_start
-            loop_end = midi_clip.loop_end
-            start_relative = midi_clip.start_relative
-            length = current_end - current_start
-            loop_length = loop_end - loop_start
-            loop = midi_clip.loop
-            for note in midi_clip.notes:
-                start = current_start + note.start - loop_start - start_relative
-                if current_start <= start < current_end:
-                    note = Note(note.pitch, start, note.duration, note.velocity,
-                                note.is_enable)
-                    midi_notes.append(note)
-                    if loop and length > loop_length - start_relative and loop_start <= note.start < loop_end:
-                        # print('!clip is looping! Loop length:', loop_length)
-                        while start < current_end:
-                            # print('note Start:', start, 'end:', current_end)
-                            note = Note(note.pitch, start, note.duration,
-                                        note.velocity, note.is_enable)
-                            midi_notes.append(note)
-                            start += loop_length
-
-                # case loop Note after start marker
-                elif loop and loop_start <= note.start < loop_end:
-                    # print(note)
-                    start = current_start + note.start - loop_start - start_relative + loop_length
-                    while start < current_end:
-                        # print('note Start:', start, 'end:', current_end)
-                        note = Note(note.pitch, start, note.duration,
-                                    note.velocity, note.is_enable)
-                        midi_notes.append(note)
-                        start += loop_length
-
+            midi_notes.extend(*expand_clip_notes(midi_clip))
         return midi_notes
 
     def map_controllers(self):
@@ -317,49 +501,159 @@ class MidiTrack:
         return controllers_map
 
 
+class TrackHandle:
+    """What is known about a track before it is parsed: its name, its id and
+    its XML element."""
+    __slots__ = ('name', 'id', 'element')
+
+    def __init__(self, element):
+        self.name = str(element.find('Name/EffectiveName').get('Value'))
+        self.id = int(element.get('Id'))
+        self.element = element
+
+    def __repr__(self):
+        return f'TrackHandle Name: {self.name} Id: {self.id}'
+
+
+class LazyTracks(Sequence):
+    """Sequence of the MidiTracks of a set, each one parsed the first time it
+    is accessed and cached afterwards.
+
+    The handles give the name and id of every track without parsing any of
+    them.
+    """
+
+    def __init__(self, elements):
+        self.handles = [TrackHandle(element) for element in elements]
+        self._tracks = [None] * len(self.handles)
+
+    def __len__(self):
+        return len(self.handles)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        track = self._tracks[index]
+        if track is None:
+            track = self._tracks[index] = MidiTrack(
+                self.handles[index].element)
+        return track
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __getstate__(self):
+        # Every track is parsed before pickling, as the elements can't be.
+        handles = []
+        for handle in self.handles:
+            handle = copy.copy(handle)
+            handle.element = None
+            handles.append(handle)
+        return {'handles': handles, '_tracks': list(self)}
+
+    def parsed(self) -> int:
+        """Number of tracks parsed so far."""
+        return sum(track is not None for track in self._tracks)
+
+
+# Track elements that are released as soon as they have been parsed when
+# a LiveSet is read in streaming mode.
+TRACK_TAGS = ('MidiTrack', 'AudioTrack', 'ReturnTrack', 'GroupTrack',
+              'MasterTrack', 'PreHearTrack')
+
+
 class LiveSet:
-    def __init__(self, file_path: str, copy: bool = False) -> None:
+    @profiling.stage('LiveSet.__init__',
+                     lambda args, result: len(args[0].tracks), 'tracks')
+    def __init__(self, file_path: str, copy: bool = False,
+                 stream: bool = False) -> None:
         self.file_path = file_path
         self.name = os.path.basename(self.file_path).replace('.als', '')
         print("LiveSet", self.name)
-        self.infos = file_handler.extract(str(file_path), copy)
-        print('Init LiveSet Parse')
-        parser = et.XMLParser(huge_tree=True)
-        self.doc = et.fromstring(self.infos, parser)
-
-        self.tempo = int(
-            self.doc.find("LiveSet/MasterTrack/DeviceChain/Mixer/Tempo").find(
-                'Manual').get('Value'))
-        self.tempo_map = self.get_tempo_map()
-        self.tracks = self.parse_tracks()
+        if stream:
+            # Neither the raw XML nor the full tree is kept around.
+            self.infos = None
+            self.doc = None
+            print('Init LiveSet Stream Parse')
+            self.tracks = self.parse_stream(copy)
+        else:
+            self.infos = file_handler.extract(str(file_path), copy)
+            print('Init LiveSet Parse')
+            parser = et.XMLParser(huge_tree=True)
+            self.doc = et.fromstring(self.infos, parser)
+
+            self.parse_tempo(self.doc.find("LiveSet/MasterTrack"))
+            self.tracks = self.parse_tracks()
         print(len(self.tracks), "Midi Tracks found")
         # print('Tempo Map', self.tempo_map)
         print('LiveSet Parse Done')
 
-    def parse_tracks(self) -> List[MidiTrack]:
+    def __getstate__(self):
+        # Only the parsed model is pickled, not the source document.
+        state = self.__dict__.copy()
+        state['infos'] = None
+        state['doc'] = None
+        return state
+
+    def parse_tempo(self, xml_master_track) -> None:
+        xml_tempo = xml_master_track.find('DeviceChain/Mixer/Tempo')
+        self.tempo = int(xml_tempo.find('Manual').get('Value'))
+        self.tempo_map = get_tempo_map(xml_tempo)
+
+    def parse_tracks(self) -> LazyTracks:
+        return LazyTracks(self.doc.xpath("//MidiTrack"))
+
+    @profiling.stage('LiveSet.parse_stream',
+                     lambda args, result: len(result), 'tracks')
+    def parse_stream(self, copy: bool) -> List[MidiTrack]:
+        """Parse the project while it is being decompressed.
+
+        Each track element is turned into a MidiTrack as soon as it is
+        complete and is then cleared, so peak memory is bounded by the
+        largest single track rather than by the whole project.
+        """
         midi_tracks = []
-        for midi_track in self.doc.xpath("//MidiTrack"):
-            track = MidiTrack(midi_track)
-            midi_tracks.append(track)
+        parser = et.XMLPullParser(events=('end',), tag=TRACK_TAGS,
+                                  huge_tree=True)
+        for chunk in file_handler.iter_extract(str(self.file_path), copy):
+            parser.feed(chunk)
+            self.consume_stream_events(parser, midi_tracks)
+        parser.close()
+        self.consume_stream_events(parser, midi_tracks)
         return midi_tracks
 
-    def get_tempo_map(self) -> List[Event]:
-        events = self.doc.findall(
-            "LiveSet/MasterTrack/DeviceChain/Mixer/Tempo/ArrangerAutomation/Events/FloatEvent")
-        float_events = []
-        for event in events:
-            time = float(event.get('Time'))
-            value = int(float(event.get('Value')))
-            cc_x = float(event.get('CurveControl1X')) if event.get(
-                'CurveControl1X') else None
-            cc_y = float(event.get('CurveControl1Y')) if event.get(
-                'CurveControl1Y') else None
-            count = len(float_events)
-            if count != 0:
-                e = Event(time, value, cc_x, cc_y,
-                          float_events[count - 1])
-            else:
-                e = Event(time, value, cc_x, cc_y)
-            float_events.append(e)
+    def consume_stream_events(self, parser, midi_tracks) -> None:
+        for _, element in parser.read_events():
+            if element.tag == 'MidiTrack':
+                track = MidiTrack(element)
+                track.release_xml()
+                midi_tracks.append(track)
+            elif element.tag == 'MasterTrack' and \
+                    element.getparent().tag == 'LiveSet':
+                self.parse_tempo(element)
+            element.clear(keep_tail=True)
+            # Drop the already processed siblings as well, otherwise the
+            # emptied elements still pile up under their parent.
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+def get_tempo_map(xml_tempo) -> List[Event]:
+    events = xml_tempo.findall('ArrangerAutomation/Events/FloatEvent')
+    float_events = []
+    for event in events:
+        time = float(event.get('Time'))
+        value = int(float(event.get('Value')))
+        cc_x = float(event.get('CurveControl1X')) if event.get(
+            'CurveControl1X') else None
+        cc_y = float(event.get('CurveControl1Y')) if event.get(
+            'CurveControl1Y') else None
+        count = len(float_events)
+        if count != 0:
+            e = Event(time, value, cc_x, cc_y,
+                      float_events[count - 1])
+        else:
+            e = Event(time, value, cc_x, cc_y)
+        float_events.append(e)
 
-        return float_events
+    return float_events
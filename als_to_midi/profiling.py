@@ -0,0 +1,151 @@
+import functools
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, Optional
+
+# Whether the stages are being measured. When it is False, a stage costs a
+# function call and this test.
+enabled = False
+# The measurements of each stage, by name, in the order they first ran.
+stages = {}  # type: Dict[str, Stage]
+# The unit of every stage declared, by name, whether it ran or not.
+declared = {}  # type: Dict[str, str]
+# The current allocation and the highest peak seen by each stage running.
+_frames = []
+
+
+class Stage:
+    __slots__ = ('name', 'unit', 'calls', 'wall', 'cpu', 'count', 'peak')
+
+    def __init__(self, name: str, unit: str) -> None:
+        self.name = name
+        self.unit = unit
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.count = 0
+        self.peak = 0
+
+    def as_dict(self) -> dict:
+        return {'calls': self.calls, 'wall': self.wall, 'cpu': self.cpu,
+                'count': self.count, 'unit': self.unit, 'peak': self.peak}
+
+
+def enable() -> None:
+    """Start measuring the stages, and tracing memory allocations."""
+    global enabled
+    enabled = True
+    stages.clear()
+    tracemalloc.start()
+
+
+def disable() -> None:
+    global enabled
+    enabled = False
+    tracemalloc.stop()
+
+
+def stage(name: str, count: Callable = None, unit: str = '') -> Callable:
+    """Decorate a function as a stage of the conversion.
+
+    While profiling is enabled, the wall time, the CPU time and the peak of
+    the memory allocated by each call are added to the stage's record, and
+    count(args, result), if given, to its count of unit. Stages can nest:
+    the time and memory of a stage include those of the stages it calls.
+    """
+    declared[name] = unit
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            record = stages.get(name)
+            if record is None:
+                record = stages[name] = Stage(name, unit)
+            _enter()
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                record.cpu += time.process_time() - cpu
+                record.wall += time.perf_counter() - wall
+                record.peak = max(record.peak, _exit())
+                record.calls += 1
+            if count is not None:
+                record.count += count(args, result)
+            return result
+        return wrapper
+    return decorator
+
+
+def _enter() -> None:
+    current, peak = tracemalloc.get_traced_memory()
+    if _frames:
+        _frames[-1][1] = max(_frames[-1][1], peak)
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    _frames.append([current, current])
+
+
+def _exit() -> int:
+    """Return the peak allocation of the stage ending, over what was
+    allocated when it began.
+
+    Without tracemalloc.reset_peak (before Python 3.9), the peak is the
+    highest since profiling was enabled, which can be larger.
+    """
+    _, peak = tracemalloc.get_traced_memory()
+    start, highest = _frames.pop()
+    highest = max(highest, peak)
+    if _frames:
+        _frames[-1][1] = max(_frames[-1][1], highest)
+    return highest - start
+
+
+def records() -> dict:
+    """The measurements of the stages, as plain dictionaries by name."""
+    return {name: record.as_dict() for name, record in stages.items()}
+
+
+def merge(other: dict) -> None:
+    """Add the measurements of the stages run in another process, as
+    returned by records there, to those of this one.
+
+    Their times are added up as if the processes had run one after another.
+    """
+    for name, measures in other.items():
+        record = stages.get(name)
+        if record is None:
+            record = stages[name] = Stage(name, measures['unit'])
+        record.calls += measures['calls']
+        record.wall += measures['wall']
+        record.cpu += measures['cpu']
+        record.count += measures['count']
+        record.peak = max(record.peak, measures['peak'])
+
+
+def report(path: Optional[str] = None) -> None:
+    """Print the measurements of the stages, or write them to path as
+    JSON.
+
+    The stages that didn't run (e.g. the parsing of a project loaded from
+    the cache) are listed last, with no calls, so that every run reports
+    the same stages.
+    """
+    for name, unit in declared.items():
+        if name not in stages:
+            stages[name] = Stage(name, unit)
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump(records(), f, indent=2)
+        print(f'profile written: {path}')
+        return
+    print(f'{"stage":<30}{"calls":>7}{"wall s":>9}{"cpu s":>9}'
+          f'{"peak MB":>9}  count')
+    for record in stages.values():
+        print(f'{record.name:<30}{record.calls:>7}{record.wall:>9.3f}'
+              f'{record.cpu:>9.3f}{record.peak / 1e6:>9.1f}  '
+              f'{record.count} {record.unit}'.rstrip())
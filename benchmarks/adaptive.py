@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Check that adaptive automation sampling (--adaptive) never writes more
+than the uniform sampling every 1/64 beat.
+
+Pitch bend ramps and curves of various lengths are rendered both ways and
+their samples counted, then synthetic sets (see corpus.py) with pitch bend
+and controller clip envelopes are exported both ways and the MIDI files
+compared. The exit status is 1 if an adaptive rendering is larger.
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+
+import corpus
+from als_to_midi import midi_export, models
+
+LENGTHS = (1 / 32, 0.25, 1, 4, 16)
+# The ranges of the pitch bend lanes: the full range, and a small bend.
+RANGES = ((-8192, 8191), (0, 512))
+
+
+def pitch_bend_lane(length: float, low: float, high: float,
+                    curve: bool) -> list:
+    """A lane going from low at beat 0 to high at length, in a ramp or a
+    curve."""
+    events = [models.Event(corpus.FAR_PAST, low, None, None)]
+    if curve:
+        events.append(models.Event(0, low, 0.8, 0.2, events[-1]))
+    else:
+        events.append(models.Event(0, low, None, None, events[-1]))
+    events.append(models.Event(length, high, None, None, events[-1]))
+    return events
+
+
+def check_lanes(tolerance: float) -> int:
+    larger = 0
+    for curve in (False, True):
+        for low, high in RANGES:
+            for length in LENGTHS:
+                events = pitch_bend_lane(length, low, high, curve)
+                uniform = len(midi_export.get_automation_events(events)[0])
+                adaptive = len(midi_export.get_automation_events(
+                    events, tolerance * midi_export.PITCH_BEND_STEP)[0])
+                flag = ''
+                if adaptive > uniform:
+                    larger += 1
+                    flag = '  LARGER'
+                print(f'{"curve" if curve else "ramp":<6}{low:>6} -> '
+                      f'{high:<5} over {length:<7} beats: {uniform:>5} '
+                      f'uniform, {adaptive:>5} adaptive samples{flag}')
+    return larger
+
+
+def export_size(als_file: str, midi_file: str, tolerance=None) -> int:
+    with contextlib.redirect_stdout(io.StringIO()):
+        midi_export.main(als_file, midi_file, tolerance=tolerance)
+    return os.path.getsize(midi_file)
+
+
+def check_sets(tolerance: float) -> int:
+    larger = 0
+    with tempfile.TemporaryDirectory() as directory:
+        als_file = os.path.join(directory, 'set.als')
+        midi_file = os.path.join(directory, 'set.mid')
+        for density in (1, 4, 16):
+            # The clips' envelopes cycle through the targets, pitch bend
+            # first.
+            corpus.generate(als_file, tracks=4, clips=len(corpus.TARGETS),
+                            envelope_density=density, mixer_density=0,
+                            tempo_density=0)
+            uniform = export_size(als_file, midi_file)
+            adaptive = export_size(als_file, midi_file, tolerance)
+            flag = ''
+            if adaptive > uniform:
+                larger += 1
+                flag = '  LARGER'
+            print(f'set of {density:>2} envelope points per beat: '
+                  f'{uniform:>8} bytes uniform, {adaptive:>8} adaptive{flag}')
+    return larger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tolerance', type=float, default=1)
+    args = parser.parse_args()
+    larger = check_lanes(args.tolerance) + check_sets(args.tolerance)
+    if larger:
+        print(f'{larger} adaptive renderings larger than uniform')
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Check that a batch export survives a worker process dying, and time it.
+
+One file of a synthetic corpus (see corpus.py) kills the worker converting
+it; every other file must still be converted. The exit status is 1
+otherwise. The crash is patched into midi_export.main before the workers
+are forked, so this needs the fork start method (Linux, macOS).
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import tempfile
+import time
+
+import corpus
+from als_to_midi import batch, midi_export
+
+convert_file = midi_export.main
+
+
+def crashing_main(als_file: str, *args, **kwargs):
+    if os.path.basename(als_file).startswith('crash'):
+        os._exit(1)
+    return convert_file(als_file, *args, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=16)
+    parser.add_argument('--crash', type=int, default=5,
+                        help='index of the file killing its worker')
+    parser.add_argument('-j', '--jobs', type=int, default=2)
+    args = parser.parse_args()
+    multiprocessing.set_start_method('fork')
+    midi_export.main = crashing_main
+
+    with tempfile.TemporaryDirectory() as directory:
+        input_dir = os.path.join(directory, 'input')
+        output_dir = os.path.join(directory, 'output')
+        os.makedirs(input_dir)
+        names = []
+        for i in range(args.files):
+            names.append(f'crash{i:03}' if i == args.crash else f'set{i:03}')
+            corpus.generate(os.path.join(input_dir, names[-1] + '.als'),
+                            tracks=2, clips=2, seed=i)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            failed = batch.batch_export([input_dir], output_dir, args.jobs)
+        elapsed = time.perf_counter() - start
+        converted = sorted(os.path.splitext(name)[0]
+                           for name in os.listdir(output_dir))
+    expected = sorted(name for name in names if not name.startswith('crash'))
+    print(f'{len(converted)}/{args.files} files converted, {failed} failed, '
+          f'in {elapsed:.2f} s with {args.jobs} workers')
+    if converted != expected or failed != args.files - len(expected):
+        print(f'expected {len(expected)} files converted and '
+              f'{args.files - len(expected)} failed')
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
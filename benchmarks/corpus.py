@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Write synthetic Ableton Live sets (gzipped ALS XML) for the benchmarks.
+
+A set holds MIDI tracks of looped MIDI clips, with notes and clip
+envelopes, along with volume, pan and tempo automation. Only the parts of
+the format that als_to_midi reads are written.
+"""
+import argparse
+import gzip
+import random
+
+# The envelope targets of the clips: indexes into a track's MidiControllers,
+# which start with pitch bend and channel pressure, followed by the CCs.
+TARGETS = (0, 1, 3, 9, 13)
+# The range of the values of each target, and of the mixer automation.
+RANGES = {0: (-8192, 8191), 1: (0, 127), 'volume': (0, 1.9),
+          'pan': (-1, 1), 'tempo': (60, 180)}
+CONTROLLER_RANGE = (0, 127)
+FAR_PAST = -63072000
+
+
+def float_events(rnd: random.Random, length: float, density: float,
+                 value_range: tuple, initial: float) -> str:
+    """An automation lane of density points per beat over length beats,
+    after a first point far in the past. Every third point starts a curve,
+    and the last point never does."""
+    low, high = value_range
+    events = [f'<FloatEvent Id="0" Time="{FAR_PAST}" Value="{initial}" />']
+    count = int(length * density)
+    for i in range(count):
+        time = i / density
+        value = round(rnd.uniform(low, high), 3)
+        curve = ''
+        if i % 3 == 1 and i < count - 1:
+            curve = (f' CurveControl1X="{round(rnd.random(), 3)}"'
+                     f' CurveControl1Y="{round(rnd.random(), 3)}"')
+        events.append(f'<FloatEvent Id="{i + 1}" Time="{time}" '
+                      f'Value="{value}"{curve} />')
+    return ''.join(events)
+
+
+def midi_clip(rnd: random.Random, index: int, start: float,
+              clip_length: float, loop_length: float, notes: int,
+              envelope_density: float) -> str:
+    by_pitch = {}
+    for _ in range(notes):
+        pitch = rnd.randrange(36, 96)
+        time = rnd.randrange(int(loop_length * 4)) / 4
+        duration = rnd.choice((0.25, 0.5, 1, 2))
+        by_pitch.setdefault(pitch, []).append(
+            f'<MidiNoteEvent Time="{time}" Duration="{duration}" '
+            f'Velocity="{rnd.randint(1, 127)}" IsEnabled="true" />')
+    key_tracks = ''.join(
+        f'<KeyTrack Id="{i}"><Notes>{"".join(events)}</Notes>'
+        f'<MidiKey Value="{pitch}" /></KeyTrack>'
+        for i, (pitch, events) in enumerate(sorted(by_pitch.items())))
+    envelopes = ''
+    if envelope_density:
+        target = TARGETS[index % len(TARGETS)]
+        events = float_events(rnd, loop_length, envelope_density,
+                              RANGES.get(target, CONTROLLER_RANGE), 0)
+        envelopes = (
+            f'<Envelopes><Envelopes><ClipEnvelope Id="0"><EnvelopeTarget>'
+            f'<PointeeId Value="{1000 + target}" /></EnvelopeTarget>'
+            f'<Automation><Events>{events}</Events></Automation>'
+            f'</ClipEnvelope></Envelopes></Envelopes>')
+    return (
+        f'<MidiClip Id="{index}" Time="{start}"><LomId Value="0" />'
+        f'<Name Value="Clip {index}" /><ColorIndex Value="{index % 70}" />'
+        f'<CurrentStart Value="{start}" />'
+        f'<CurrentEnd Value="{start + clip_length}" />'
+        f'<Loop><LoopStart Value="0" /><LoopEnd Value="{loop_length}" />'
+        f'<StartRelative Value="0" /><LoopOn Value="true" /></Loop>'
+        f'<TimeSignature><TimeSignatures><RemoteableTimeSignature>'
+        f'<Numerator Value="4" /></RemoteableTimeSignature></TimeSignatures>'
+        f'</TimeSignature><Notes><KeyTracks>{key_tracks}</KeyTracks></Notes>'
+        f'{envelopes}</MidiClip>')
+
+
+def midi_track(rnd: random.Random, index: int, clips: int,
+               clip_length: float, loop_length: float, notes: int,
+               envelope_density: float, mixer_density: float) -> str:
+    length = clips * clip_length
+    midi_clips = ''.join(
+        midi_clip(rnd, i, i * clip_length, clip_length, loop_length, notes,
+                  envelope_density) for i in range(clips))
+    volume = float_events(rnd, length, mixer_density, RANGES['volume'], 0.85)
+    pan = float_events(rnd, length, mixer_density, RANGES['pan'], 0)
+    controllers = ''.join(f'<ControllerTargets.{i} Id="{1000 + i}" />'
+                          for i in range(130))
+    return (
+        f'<MidiTrack Id="{index}"><Name>'
+        f'<EffectiveName Value="Track {index}" /></Name>'
+        f'<ColorIndex Value="{index % 70}" /><TrackGroupId Value="-1" />'
+        f'<TrackUnfolded Value="true" /><MidiFoldIn Value="false" />'
+        f'<MidiPrelisten Value="false" /><Freeze Value="false" />'
+        f'<DeviceChain><Mixer>'
+        f'<Volume><ArrangerAutomation><Events>{volume}</Events>'
+        f'</ArrangerAutomation></Volume>'
+        f'<Pan><ArrangerAutomation><Events>{pan}</Events>'
+        f'</ArrangerAutomation></Pan></Mixer>'
+        f'<MainSequencer><ClipTimeable><ArrangerAutomation><Events>'
+        f'{midi_clips}</Events></ArrangerAutomation></ClipTimeable>'
+        f'<MidiControllers>{controllers}</MidiControllers></MainSequencer>'
+        f'</DeviceChain></MidiTrack>')
+
+
+def generate(path: str, tracks: int = 8, clips: int = 8, notes: int = 32,
+             clip_length: float = 16, loop_length: float = 4,
+             envelope_density: float = 4, mixer_density: float = 1,
+             tempo_density: float = 0.25, seed: int = 0) -> None:
+    """Write a set of tracks MIDI tracks, each a row of clips clip_length
+    beats long, looping notes notes over loop_length beats.
+
+    The densities are the number of automation points per beat of the clip
+    envelopes (over the loop), of the volume and pan automation and of the
+    tempo automation (over the arrangement); 0 leaves the lanes with a
+    single value.
+    """
+    rnd = random.Random(seed)
+    midi_tracks = ''.join(
+        midi_track(rnd, i, clips, clip_length, loop_length, notes,
+                   envelope_density, mixer_density) for i in range(tracks))
+    tempo = float_events(rnd, clips * clip_length, tempo_density,
+                         RANGES['tempo'], 120)
+    xml = (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<Ableton MajorVersion="5" MinorVersion="10.0_377">'
+        f'<LiveSet><Tracks>{midi_tracks}</Tracks>'
+        f'<MasterTrack><DeviceChain><Mixer><Tempo><Manual Value="120" />'
+        f'<ArrangerAutomation><Events>{tempo}</Events></ArrangerAutomation>'
+        f'</Tempo></Mixer></DeviceChain></MasterTrack></LiveSet></Ableton>')
+    with gzip.open(path, 'wb') as f:
+        f.write(xml.encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('als_file', type=str)
+    parser.add_argument('--tracks', type=int, default=8)
+    parser.add_argument('--clips', type=int, default=8,
+                        help='clips per track')
+    parser.add_argument('--notes', type=int, default=32,
+                        help='notes per clip loop')
+    parser.add_argument('--clip-length', type=float, default=16,
+                        help='length of the clips, in beats')
+    parser.add_argument('--loop-length', type=float, default=4,
+                        help='length of the clip loops, in beats')
+    parser.add_argument('--envelope-density', type=float, default=4,
+                        help='clip envelope points per beat')
+    parser.add_argument('--mixer-density', type=float, default=1,
+                        help='volume and pan automation points per beat')
+    parser.add_argument('--tempo-density', type=float, default=0.25,
+                        help='tempo automation points per beat')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.als_file, args.tracks, args.clips, args.notes,
+             args.clip_length, args.loop_length, args.envelope_density,
+             args.mixer_density, args.tempo_density, args.seed)
+
+
+if __name__ == '__main__':
+    main()
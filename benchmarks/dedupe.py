@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Time MIDITrack.removeDuplicates on a track of notes, a tenth of them
+doubled, and 1/64-beat controller lanes."""
+import argparse
+import random
+import time
+
+from als_to_midi import MidiFile
+
+
+def build_track(events: int) -> MidiFile.MIDITrack:
+    rnd = random.Random(0)
+    track = MidiFile.MIDITrack(True, True)
+    notes = events // 4
+    for i in range(notes):
+        # Every tenth note is doubled, as overlapping looped clips do.
+        start = rnd.randrange(events // 16) / 4
+        pitch = rnd.randrange(36, 84)
+        track.addNoteByNumber(0, pitch, start, 0.25, 100, insertion_order=i)
+        if i % 10 == 0:
+            track.addNoteByNumber(0, pitch, start, 0.25, 100,
+                                  insertion_order=i)
+    for i in range(events - len(track.eventList)):
+        track.addControllerEvent(0, i / 64, 1 + i % 2, i % 128,
+                                 insertion_order=notes + i)
+    return track
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000])
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        track = build_track(size)
+        start = time.perf_counter()
+        track.removeDuplicates()
+        elapsed = time.perf_counter() - start
+        print(f'{size:>9} events: {elapsed:8.3f} s '
+              f'({elapsed / size * 1e6:.2f} us/event, '
+              f'{len(track.eventList)} kept)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Time MIDITrack.writeEventsToStream on growing controller lanes.
+
+The time per event should stay flat as the track grows, i.e. the total
+cost is linear in the number of events.
+"""
+import argparse
+import time
+
+from als_to_midi import MidiFile
+
+
+def build_track(events: int) -> MidiFile.MIDITrack:
+    track = MidiFile.MIDITrack(True, True)
+    # A 1/64-beat CC lane, already in relative (delta) ticks.
+    delta = MidiFile.TICKSPERBEAT / 64
+    for i in range(events):
+        event = MidiFile.MIDIControllerEvent('ControllerEvent', delta, 1, i)
+        event.channel = 0
+        event.controller_number = 1
+        event.parameter = i % 128
+        track.MIDIEventList.append(event)
+    return track
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        track = build_track(size)
+        start = time.perf_counter()
+        track.writeEventsToStream()
+        elapsed = time.perf_counter() - start
+        print(f'{size:>9} events: {elapsed:8.3f} s '
+              f'({elapsed / size * 1e6:.2f} us/event, '
+              f'{len(track.MIDIdata)} bytes)')
+
+
+if __name__ == '__main__':
+    main()
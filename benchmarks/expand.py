@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Check that the numpy and the pure Python placement of looping clip notes
+(models.expand_clip_notes) agree, and time them.
+
+The clips are random layouts of start, end, loop and StartRelative, the
+latter negative for some of them. The exit status is 1 if the two
+placements differ on any clip.
+"""
+import argparse
+import random
+import time
+from types import SimpleNamespace
+
+from als_to_midi import models
+
+# A looped clip whose note starts after its end, in the arrangement.
+NEGATIVE_START_RELATIVE = dict(start=0, end=0.5, loop_start=0, loop_end=1,
+                               start_relative=-3, loop=True, notes=[0.75])
+
+
+def make_clip(start, end, loop_start, loop_end, start_relative, loop,
+              notes):
+    columns = models.NoteColumns()
+    for note_start in notes:
+        columns.add(60, note_start, 0.25, 100, True)
+    return SimpleNamespace(start=start, end=end, loop_start=loop_start,
+                           loop_end=loop_end, start_relative=start_relative,
+                           loop=loop, notes=columns)
+
+
+def random_clip(rnd: random.Random):
+    start = rnd.randrange(64) / 4
+    loop_start = rnd.randrange(16) / 4
+    loop_length = rnd.randrange(1, 32) / 4
+    notes = [rnd.randrange(-8, 48) / 4 for _ in range(rnd.randrange(1, 16))]
+    return make_clip(start, start + rnd.randrange(1, 128) / 4, loop_start,
+                     loop_start + loop_length,
+                     rnd.randrange(-32, 16) / 4, rnd.random() < 0.8, notes)
+
+
+def expand(clip, vectorized: bool):
+    """The placed notes of clip, as lists."""
+    if vectorized:
+        columns = models.expand_clip_notes_vectorized(clip)
+    else:
+        np = models.np
+        models.np = None
+        try:
+            columns = models.expand_clip_notes(clip)
+        finally:
+            models.np = np
+    return [list(column) for column in columns]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clips', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if models.np is None:
+        parser.error('numpy is not installed')
+
+    rnd = random.Random(args.seed)
+    clips = [make_clip(**NEGATIVE_START_RELATIVE)]
+    clips += [random_clip(rnd) for _ in range(args.clips)]
+    results = {}
+    for vectorized in (False, True):
+        start = time.perf_counter()
+        results[vectorized] = [expand(clip, vectorized) for clip in clips]
+        elapsed = time.perf_counter() - start
+        print(f'vectorized={vectorized!s:5} {elapsed:.3f} s')
+    mismatches = sum(scalar != vectorized for scalar, vectorized
+                     in zip(results[False], results[True]))
+    print(f'{mismatches}/{len(clips)} clips placed differently')
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Measure the memory footprint of the per-event objects.
+
+Reports the bytes allocated per models.Note, per MidiFile note and
+controller event in a track's eventList, and per MIDIEvent created from
+them by processEventList.
+"""
+import argparse
+import tracemalloc
+
+from als_to_midi import MidiFile, models
+
+
+def measure(prepare, build, count: int) -> float:
+    """Bytes allocated by build(prepare(count)) per event; only build is
+    traced."""
+    prepared = prepare(count)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build(prepared)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / count
+
+
+def model_notes(count: int):
+    return [models.Note(60, i / 4, 0.25, 100, 'true') for i in range(count)]
+
+
+def track_notes(count: int):
+    track = MidiFile.MIDITrack(False, False)
+    for i in range(count):
+        track.addNoteByNumber(0, 60, i / 4, 0.25, 100, insertion_order=i)
+    return track
+
+
+def track_controllers(count: int):
+    track = MidiFile.MIDITrack(False, False)
+    for i in range(count):
+        track.addControllerEvent(0, i / 64, 1, i % 128, insertion_order=i)
+    return track
+
+
+def process(track):
+    track.processEventList()
+    return track
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=200000)
+    args = parser.parse_args()
+
+    for name, prepare, build in [
+            ('models.Note', int, model_notes),
+            ('MidiFile.Note', int, track_notes),
+            ('MidiFile.ControllerEvent', int, track_controllers),
+            ('MIDIEvent per note (on + off)', track_notes, process),
+            ('MIDIEvent per controller', track_controllers, process)]:
+        print(f'{name:>30}: '
+              f'{measure(prepare, build, args.count):7.1f} bytes/event')
+
+if __name__ == '__main__':
+    main()
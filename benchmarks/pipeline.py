@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Time each stage of the conversion of ALS files to MIDI, record the
+results as JSON and compare them with a baseline.
+
+Without ALS files, a corpus of synthetic sets is generated (see corpus.py).
+Each stage is run --repeat times and its best time is kept. A stage is a
+regression when it is more than --threshold slower than in the baseline
+(and by more than 5 ms); the exit status is then 1.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from lxml import etree as et
+
+import corpus
+from als_to_midi import MidiFile, automation_curve, file_handler, \
+    midi_export, models
+
+# The synthetic sets, as arguments of corpus.generate.
+CORPUS = {
+    'small': dict(tracks=4, clips=4),
+    'many_tracks': dict(tracks=64, clips=4, notes=16, envelope_density=0),
+    'many_notes': dict(tracks=8, clips=16, notes=256, envelope_density=0,
+                       mixer_density=0),
+    'dense_automation': dict(tracks=8, clips=8, envelope_density=16,
+                             mixer_density=16, tempo_density=4),
+}
+MIN_DIFFERENCE = 0.005
+
+
+def best_time(function, repeat: int, prepare=None) -> float:
+    """The best wall time of repeat calls of function, on what prepare
+    returns if given (prepare itself isn't timed)."""
+    best = None
+    for _ in range(repeat):
+        args = (prepare(),) if prepare is not None else ()
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def render_automation(live_set: models.LiveSet) -> int:
+    """Render every automation lane of live_set; return the sample count."""
+    count = len(midi_export.get_automation_events(live_set.tempo_map)[0])
+    for track in live_set.tracks:
+        for clip in track.arrangement_clips:
+            for envelope in clip.envelopes:
+                count += len(midi_export.get_automation_events(
+                    envelope.events)[0])
+        count += len(midi_export.get_automation_events(
+            track.volume_automation_events)[0])
+        count += len(midi_export.get_automation_events(
+            track.pan_automation_events)[0])
+    return count
+
+
+def build_file(live_set: models.LiveSet) -> MidiFile.MIDIFile:
+    midi = MidiFile.MIDIFile(len(live_set.tracks), file_format=1,
+                             adjust_origin=True)
+    midi_export.add_tempo_map(midi, live_set)
+    track_id = 0
+    for track in live_set.tracks:
+        if track.midi_export:
+            midi_export.add_track(midi, track, track_id, track_id % 16)
+            track_id += 1
+    return midi
+
+
+def closed_file(live_set: models.LiveSet) -> MidiFile.MIDIFile:
+    midi = build_file(live_set)
+    midi.close()
+    return midi
+
+
+def benchmark(als_file: str, repeat: int) -> dict:
+    """Time the stages of the conversion of als_file."""
+    stages = {}
+    infos = file_handler.extract(als_file, False)
+    stages['extract'] = best_time(
+        lambda: file_handler.extract(als_file, False), repeat)
+    stages['xml'] = best_time(
+        lambda: et.fromstring(infos, et.XMLParser(huge_tree=True)), repeat)
+    stages['live_set'] = best_time(lambda: models.LiveSet(als_file), repeat)
+    stages['tracks'] = best_time(
+        lambda live_set: list(live_set.tracks), repeat,
+        lambda: models.LiveSet(als_file))
+
+    live_set = models.LiveSet(als_file)
+    tracks = list(live_set.tracks)
+    stages['notes'] = best_time(
+        lambda: [track.parse_notes() for track in tracks], repeat)
+    stages['automation'] = best_time(
+        lambda: render_automation(live_set), repeat)
+    stages['build'] = best_time(lambda: build_file(live_set), repeat)
+    stages['close'] = best_time(lambda midi: midi.close(), repeat,
+                                lambda: build_file(live_set))
+    stages['write'] = best_time(lambda midi: midi.writeFile(io.BytesIO()),
+                                repeat, lambda: closed_file(live_set))
+
+    output = io.BytesIO()
+    build_file(live_set).writeFile(output)
+    counts = {
+        'tracks': len(tracks),
+        'notes': sum(len(track.notes) for track in tracks),
+        'automation_samples': render_automation(live_set),
+        'midi_bytes': len(output.getvalue()),
+    }
+    return {'stages': stages, 'counts': counts}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Print the stages next to the baseline; return the regressions."""
+    regressions = []
+    for name, result in results['sets'].items():
+        print(name)
+        base = baseline['sets'].get(name, {}).get('stages', {})
+        for stage, seconds in result['stages'].items():
+            line = f'  {stage:<12}{seconds * 1000:10.1f} ms'
+            if stage in base:
+                ratio = seconds / base[stage] if base[stage] else 1
+                line += f'{base[stage] * 1000:10.1f} ms {ratio:6.2f}x'
+                if ratio > 1 + threshold and \
+                        seconds - base[stage] > MIN_DIFFERENCE:
+                    line += '  REGRESSION'
+                    regressions.append((name, stage))
+            print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('als_files', type=str, nargs='*',
+                        help='ALS files (default: a synthetic corpus)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', type=str,
+                        help='write the results to this JSON file')
+    parser.add_argument('--baseline', type=str,
+                        help='compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown flagged as a regression '
+                             '(default: 0.2, 20%%)')
+    args = parser.parse_args()
+
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': automation_curve.np is not None,
+        },
+        'sets': {},
+    }
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        als_files = {}
+        for als_file in args.als_files:
+            als_files[os.path.basename(als_file)] = als_file
+        if not als_files:
+            for name, options in CORPUS.items():
+                als_files[name] = os.path.join(corpus_dir, f'{name}.als')
+                corpus.generate(als_files[name], **options)
+        for name, als_file in als_files.items():
+            print(f'{name}...', file=sys.stderr)
+            with contextlib.redirect_stdout(io.StringIO()):
+                results['sets'][name] = benchmark(als_file, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    baseline = {'sets': {}}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f'{len(regressions)} regressions')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
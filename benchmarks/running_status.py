@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Compare the size of the MIDI files exported from ALS files, and the time
+spent encoding them (MIDIFile.close), with and without running status."""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+from als_to_midi import MidiFile, midi_export, models
+
+
+def build_file(live_set: models.LiveSet,
+               running_status: bool) -> MidiFile.MIDIFile:
+    midi = MidiFile.MIDIFile(len(live_set.tracks), file_format=1,
+                             adjust_origin=True,
+                             running_status=running_status,
+                             note_off_as_note_on=running_status)
+    midi_export.add_tempo_map(midi, live_set)
+    track_id = 0
+    for track in live_set.tracks:
+        if track.midi_export:
+            midi_export.add_track(midi, track, track_id, track_id % 16)
+            track_id += 1
+    return midi
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('als_files', type=str, nargs='+')
+    args = parser.parse_args()
+
+    for als_file in args.als_files:
+        with contextlib.redirect_stdout(io.StringIO()):
+            live_set = models.LiveSet(als_file)
+        print(os.path.basename(als_file))
+        sizes = []
+        for running_status in (False, True):
+            with contextlib.redirect_stdout(io.StringIO()):
+                midi = build_file(live_set, running_status)
+            events = sum(len(track.eventList) for track in midi.tracks)
+            start = time.perf_counter()
+            midi.close()
+            elapsed = time.perf_counter() - start
+            output = io.BytesIO()
+            midi.writeFile(output)
+            sizes.append(len(output.getvalue()))
+            print(f'  running_status={running_status!s:5} '
+                  f'{sizes[-1]:>10} bytes, close {elapsed:.3f} s '
+                  f'({events / elapsed:,.0f} events/s)')
+        print(f'  {100 - 100 * sizes[1] / sizes[0]:.1f}% smaller')
+
+
+if __name__ == '__main__':
+    main()
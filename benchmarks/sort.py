@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Time MIDIFile.close on a track of looped notes and controller lanes, and
+the part of it spent sorting events.
+
+The sorting time is read from a profile of a second, identical close.
+"""
+import argparse
+import cProfile
+import pstats
+import time
+
+from als_to_midi import MidiFile
+
+
+def build_file(events: int) -> MidiFile.MIDIFile:
+    midi = MidiFile.MIDIFile(1, file_format=1, adjust_origin=True)
+    midi.addTempo(0, 0, 120)
+    # Half of the events come from notes (a note on and a note off each),
+    # added like midi_export does: a one bar pattern of 16 pitches, each
+    # pitch with its repetitions over the arrangement.
+    repetitions = events // 4 // 16
+    pitches, starts = [], []
+    for step in range(16):
+        for bar in range(repetitions):
+            pitches.append(36 + step)
+            starts.append(bar * 4 + step / 4)
+    count = len(starts)
+    midi.addNotes(0, 0, pitches, starts, [0.2] * count, [100] * count)
+    # The other half comes from two 1/64-beat controller lanes.
+    for controller in (1, 11):
+        for i in range(events // 4):
+            midi.addControllerEvent(0, 0, i / 64, controller, i % 128)
+    return midi
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=1000000)
+    args = parser.parse_args()
+
+    midi = build_file(args.events)
+    start = time.perf_counter()
+    midi.close()
+    elapsed = time.perf_counter() - start
+
+    midi = build_file(args.events)
+    profile = cProfile.Profile()
+    profile.runcall(midi.close)
+    stats = pstats.Stats(profile).stats
+    sorting = sum(total for (_, _, name), (_, _, _, total, _) in stats.items()
+                  if 'sort' in name or 'merge' in name)
+    print(f'{args.events} events: close {elapsed:.3f} s, '
+          f'sorting {sorting:.3f} s (profiled)')
+
+
+if __name__ == '__main__':
+    main()
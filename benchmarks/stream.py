@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Measure the time and the peak memory of MIDIFile.writeFile on a file of
+many tracks of notes and controller lanes, with and without streaming.
+
+The peak is the memory allocated by writeFile itself, over the events
+already added, as traced by tracemalloc.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from als_to_midi import MidiFile
+
+
+def build_file(tracks: int, events: int) -> MidiFile.MIDIFile:
+    midi = MidiFile.MIDIFile(tracks, file_format=1, adjust_origin=True)
+    midi.addTempo(0, 0, 120)
+    for track in range(tracks):
+        # A quarter of the events of a track come from notes (a note on and a
+        # note off each), the rest from a 1/64-beat controller lane.
+        notes = events // 8
+        midi.addNotes(track, track % 16, [36 + i % 48 for i in range(notes)],
+                      [i / 4 for i in range(notes)], [0.2] * notes,
+                      [100] * notes)
+        for i in range(events - 2 * notes):
+            midi.addControllerEvent(track, track % 16, i / 64, 1, i % 128)
+    return midi
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tracks', type=int, default=200)
+    parser.add_argument('--events', type=int, default=2000,
+                        help='events per track')
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.mid')
+    os.close(fd)
+    try:
+        for stream in (False, True):
+            midi = build_file(args.tracks, args.events)
+            tracemalloc.start()
+            start = time.perf_counter()
+            with open(path, 'wb') as f:
+                midi.writeFile(f, stream=stream)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'stream={stream!s:5} {args.tracks} tracks: '
+                  f'{elapsed:.3f} s, peak {peak / 1e6:.1f} MB, '
+                  f'{os.path.getsize(path)} bytes')
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Check that a tempo map rendered as steps (--tempo-resolution,
+--tempo-threshold) stays within midi_export.MAX_TEMPO_DRIFT of the
+continuous tempo curve.
+
+Synthetic sets (see corpus.py) with dense tempo automation are exported
+with various step lengths and thresholds. The tempo events are read back
+from the MIDI files and the time in seconds of every sample of the curve
+(every 1/64 beat) is compared with its time on the continuous curve. The
+exit status is 1 if any sample drifts further than the limit.
+"""
+import argparse
+import contextlib
+import io
+import os
+import struct
+import tempfile
+
+import corpus
+from als_to_midi import midi_export, models
+
+# The options of each export: step lengths in beats, thresholds in
+# microseconds per quarter note.
+RENDERINGS = (dict(tempo_resolution=1), dict(tempo_resolution=4),
+              dict(tempo_resolution=64), dict(tempo_threshold=1000),
+              dict(tempo_threshold=20000))
+# The microsecond the MIDI file rounds each tempo to, over a step.
+SLACK = 1e-6
+
+
+def read_tempos(midi_file: str) -> list:
+    """The (beat, microseconds per quarter note) of the tempo events of the
+    first track of midi_file."""
+    with open(midi_file, 'rb') as f:
+        data = f.read()
+    division = struct.unpack('>H', data[12:14])[0]
+    position = 14 + 8
+    end = 14 + 8 + struct.unpack('>L', data[18:22])[0]
+    tick = 0
+    status = None
+    tempos = []
+
+    def variable_length():
+        nonlocal position
+        value = 0
+        while True:
+            byte = data[position]
+            position += 1
+            value = value << 7 | byte & 0x7F
+            if not byte & 0x80:
+                return value
+
+    while position < end:
+        tick += variable_length()
+        if data[position] & 0x80:
+            status = data[position]
+            position += 1
+        if status == 0xFF:
+            kind = data[position]
+            position += 1
+            length = variable_length()
+            if kind == 0x51:
+                tempos.append((tick / division, int.from_bytes(
+                    data[position:position + length], 'big')))
+            position += length
+        elif status in (0xF0, 0xF7):
+            position += variable_length()
+        else:
+            position += 1 if status & 0xF0 in (0xC0, 0xD0) else 2
+    return tempos
+
+
+def max_drift(tempo_map, tempos: list) -> float:
+    """The largest difference, in seconds, between the time of a sample of
+    the tempo curve on the curve and with the tempo events."""
+    times, values = midi_export.get_automation_events(tempo_map,
+                                                      truncate=False)
+    times, values = times.tolist(), values.tolist()
+    curve = 0.0
+    rendered = 0.0
+    index = 0
+    # The time of the current tempo event, in beats and in seconds.
+    event_time = event_seconds = 0.0
+    drift = 0.0
+    for k, time in enumerate(times):
+        if k:
+            curve += (time - times[k - 1]) * (60 / values[k] +
+                                              60 / values[k - 1]) / 2
+        while index + 1 < len(tempos) and tempos[index + 1][0] <= time:
+            event_seconds += (tempos[index + 1][0] - event_time) * \
+                tempos[index][1] / 1e6
+            event_time = tempos[index + 1][0]
+            index += 1
+        rendered = event_seconds + (time - event_time) * tempos[index][1] / 1e6
+        drift = max(drift, abs(rendered - curve))
+    return drift
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--density', type=float, nargs='+',
+                        default=[1, 4, 16],
+                        help='tempo automation points per beat')
+    parser.add_argument('--clips', type=int, default=8)
+    args = parser.parse_args()
+    limit = midi_export.MAX_TEMPO_DRIFT
+
+    over = 0
+    with tempfile.TemporaryDirectory() as directory:
+        als_file = os.path.join(directory, 'set.als')
+        midi_file = os.path.join(directory, 'set.mid')
+        for density in args.density:
+            corpus.generate(als_file, tracks=1, clips=args.clips, notes=4,
+                            envelope_density=0, mixer_density=0,
+                            tempo_density=density)
+            with contextlib.redirect_stdout(io.StringIO()):
+                live_set = models.LiveSet(als_file)
+            for options in RENDERINGS:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    midi_export.midi_export(live_set, midi_file, True,
+                                            **options)
+                tempos = read_tempos(midi_file)
+                drift = max_drift(live_set.tempo_map, tempos)
+                flag = ''
+                if drift > limit + SLACK:
+                    over += 1
+                    flag = '  OVER'
+                name, value = next(iter(options.items()))
+                print(f'{density:>4} points per beat, {name}={value:<6} '
+                      f'{len(tempos):>5} events, drift '
+                      f'{drift * 1000:.3f} ms{flag}')
+    if over:
+        print(f'{over} renderings drift more than {limit * 1000:g} ms')
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,115 @@
 #!/usr/bin/env python3
 import argparse
+import sys
 
-from als_to_midi import __description__
+from als_to_midi import __description__, cache, profiling
+from als_to_midi.batch import batch_export
 from als_to_midi.midi_export import main
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description=__description__)
-    parser.add_argument('als_file', type=str, help='input ALS file')
-    parser.add_argument('midi_file', type=str, help='output MIDI file')
+    parser.add_argument('als_file', type=str, nargs='?',
+                        help='input ALS file')
+    parser.add_argument('midi_file', type=str, nargs='?',
+                        help='output MIDI file')
+    parser.add_argument('--stream', action='store_true',
+                        help='parse the ALS file while decompressing it, '
+                             'keeping memory bounded by the largest track')
+    parser.add_argument('--batch', type=str, nargs='+', metavar='INPUT',
+                        help='convert every ALS file in these directories '
+                             'or glob patterns')
+    parser.add_argument('-o', '--output-dir', type=str,
+                        help='output directory for --batch')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes, converting '
+                             'files for --batch (default: one per CPU) or '
+                             'encoding the tracks of a single file '
+                             '(default: none)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='reuse the unchanged tracks of the previous '
+                             'incremental export of midi_file')
+    parser.add_argument('--thin', action='store_true',
+                        help='leave out the automation events that repeat '
+                             'the previous value of their controller')
+    parser.add_argument('--adaptive', type=float, metavar='TOLERANCE',
+                        help='sample automation only where its MIDI value '
+                             'moves by TOLERANCE controller steps or more '
+                             '(1 for every change; a step is 128 for pitch '
+                             'bends), instead of every 1/64 beat')
+    parser.add_argument('--tempo-resolution', type=float, metavar='BEATS',
+                        help='write tempo ramps as steps of BEATS beats, '
+                             'instead of every 1/64 beat')
+    parser.add_argument('--tempo-threshold', type=float, metavar='USEC',
+                        help='write tempo ramps as steps ending where the '
+                             'tempo moves by more than USEC microseconds per '
+                             'quarter note')
+    parser.add_argument('--running-status', action='store_true',
+                        help='leave out the status bytes that repeat the '
+                             'previous one, writing note offs as note ons '
+                             'of velocity 0')
+    parser.add_argument('--budget', type=float, metavar='BYTES',
+                        help='drop the least significant automation points '
+                             'until the file fits in BYTES per second (3125 '
+                             'for a DIN MIDI link), keeping every note')
+    parser.add_argument('--budget-per-channel', action='store_true',
+                        help='apply --budget to each channel rather than to '
+                             'the whole file')
+    parser.add_argument('--profile', action='store_true',
+                        help='report the time, CPU time and peak memory of '
+                             'each stage of the conversion')
+    parser.add_argument('--profile-output', type=str, metavar='JSON_FILE',
+                        help='write the --profile measurements to JSON_FILE '
+                             'instead')
+    # Escaped for argparse, which formats the help with %.
+    cache_dir = cache.CACHE_DIR.replace('%', '%%')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the parsed projects in a cache, and load '
+                             'them from it when converting the same file '
+                             f'again: pickles in {cache_dir} (set '
+                             'ALS_TO_MIDI_CACHE to move it), up to '
+                             f'{cache.MAX_SIZE // 2 ** 20} MB')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='empty the cache of parsed projects')
 
     args = parser.parse_args()
+    profile = args.profile or args.profile_output is not None
 
-    main(args.als_file, args.midi_file)
+    if args.clear_cache:
+        cache.clear()
+        if not args.als_file and not args.batch:
+            sys.exit(0)
+
+    if args.batch:
+        if args.als_file or not args.output_dir:
+            parser.error('--batch takes an --output-dir and no positional '
+                         'arguments')
+        if profile:
+            # The files are converted in worker processes.
+            parser.error('--profile profiles the conversion of a single '
+                         'file, not --batch')
+        failed = batch_export(args.batch, args.output_dir, args.jobs,
+                              stream=args.stream, cache=args.cache,
+                              incremental=args.incremental, thin=args.thin,
+                              tolerance=args.adaptive,
+                              tempo_resolution=args.tempo_resolution,
+                              tempo_threshold=args.tempo_threshold,
+                              running_status=args.running_status,
+                              budget=args.budget,
+                              budget_per_channel=args.budget_per_channel)
+        sys.exit(1 if failed else 0)
+
+    if not args.als_file or not args.midi_file:
+        parser.error('the following arguments are required: als_file, '
+                     'midi_file')
+    if profile:
+        profiling.enable()
+    main(args.als_file, args.midi_file, stream=args.stream,
+         cache=args.cache, incremental=args.incremental,
+         jobs=args.jobs, thin=args.thin, tolerance=args.adaptive,
+         tempo_resolution=args.tempo_resolution,
+         tempo_threshold=args.tempo_threshold,
+         running_status=args.running_status, budget=args.budget,
+         budget_per_channel=args.budget_per_channel)
+    if profile:
+        profiling.report(args.profile_output)
@@ -22,5 +22,8 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     python_requires='>=3.6',
+    extras_require={
+        'numpy': ['numpy'],
+    },
     scripts=["bin/als2midi.py"]
 )